@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# benchmark_read_svb.py
+
+# Compare the single read supervoxel reader of track_utils with the
+# previous reader, that unpacked every pixel with struct, on a
+# synthetic .svb file.
+# Call: py code_snaps/benchmark_read_svb.py <n_supervoxels> <n_pixels_per_supervoxel>
+
+import numpy as np
+import struct
+import tempfile
+import shutil
+import sys
+from os.path import join, dirname, abspath
+from timeit import default_timer as timer
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from track_utils import readSuperVoxelFromFile
+
+def readSuperVoxelFromFileStruct(filename, imageDim = 3):
+    """
+    Previous reader, with a struct.unpack per header
+    field and per pixel list
+    """
+    fid = open(filename, 'rb')
+    numSv, = struct.unpack('i', fid.read(4))
+    TM = np.zeros(numSv)
+    dataSizeInBytes = np.zeros(numSv)
+    dataDims = np.zeros((imageDim, numSv))
+    pixIDlist = [np.zeros(1),]*numSv
+    for k in range(numSv):
+        TM[k], = struct.unpack('i', fid.read(4))
+        dataSizeInBytes[k], = struct.unpack('Q', fid.read(8))
+        dataDims[:,k] = np.asarray(struct.unpack('Q'*imageDim, fid.read(8*imageDim)))
+        ll, = struct.unpack('I', fid.read(4))
+        if ll>0:
+            pixIDlist[k] = np.asarray(struct.unpack('Q'*ll, fid.read(8*ll)))
+        else:
+            pixIDlist[k] = np.asarray([])
+    fid.close()
+
+    return dataDims, pixIDlist
+
+def writeSyntheticSvb(path, n_sv, n_pixels, dims = (512, 512, 50)):
+    """
+    Write n_sv supervoxels with about n_pixels each, in the
+    format written by the tracking software
+    """
+    rnd = np.random.RandomState(0)
+    n_voxels = int(np.prod(dims))
+    with open(path, 'wb') as f:
+        f.write(struct.pack('i', n_sv))
+        for k in range(n_sv):
+            ll = rnd.randint(0, 2*n_pixels+1)
+            pixels = np.sort(rnd.randint(0, n_voxels, ll)).astype(np.uint64)
+            f.write(struct.pack('i', 0))
+            f.write(struct.pack('Q', 8*n_voxels))
+            f.write(struct.pack('QQQ', *dims))
+            f.write(struct.pack('I', ll))
+            f.write(pixels.tobytes())
+
+def main(*args):
+
+    n_sv = 5000
+    n_pixels = 400
+    if len(args) >= 2:
+        n_sv = int(args[0])
+        n_pixels = int(args[1])
+
+    folder = tempfile.mkdtemp()
+    try:
+        path = join(folder, 'GMEMfinalResult_frame0000.svb')
+        print('Writing %d supervoxels with about %d pixels each...'%(n_sv, n_pixels))
+        writeSyntheticSvb(path, n_sv, n_pixels)
+
+        start = timer()
+        dims_struct, pix_struct = readSuperVoxelFromFileStruct(path)
+        time_struct = timer() - start
+
+        start = timer()
+        dims_view, pix_view = readSuperVoxelFromFile(path)
+        time_view = timer() - start
+
+        same = np.array_equal(dims_struct, dims_view) and all(
+            np.array_equal(a, b) for a, b in zip(pix_struct, pix_view))
+        print('Same output: %s'%str(same))
+        print('struct reader: %.3f s'%time_struct)
+        print('Single read reader: %.3f s'%time_view)
+        print('Speedup: %.1fx'%(time_struct/time_view))
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
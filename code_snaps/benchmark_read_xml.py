@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# benchmark_read_xml.py
+
+# Compare the streaming XML reader of track_utils with the
+# previous DOM/xpath based reader on a synthetic TGMM run.
+# Call: py code_snaps/benchmark_read_xml.py <n_frames> <n_nuclei>
+
+import numpy as np
+import lxml.etree as etree
+import tempfile
+import shutil
+import os
+import sys
+from os.path import join, dirname, abspath
+from timeit import default_timer as timer
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from track_utils import readXMLAmat, corrTIFPath
+
+def readXMLAmatDOM(filename, time_ini, time_end, symbol = '?'):
+    """
+    Previous reader, building the whole DOM and
+    querying each attribute with xpath
+    """
+    n_param_read = 6
+    pos = [[[],]*n_param_read,]*(time_end-time_ini+1)
+    for t, time_path in enumerate(range(time_ini, time_end+1, 1)):
+        xml_path_corr = corrTIFPath(filename, symbol, time_path)
+        tree = etree.parse(xml_path_corr)
+        root = tree.getroot()
+        all_points = root.xpath('GaussianMixtureModel')
+        x = []
+        y = []
+        z = []
+        svID = []
+        ID = []
+        parent = []
+        for point in all_points:
+            try:
+                [x_aux, y_aux, z_aux] = [float(x) for x in point.xpath('attribute::m')[0].split()]
+                x.append(x_aux)
+                y.append(y_aux)
+                z.append(z_aux)
+                svID.append([int(a) for a in point.xpath('attribute::svIdx')[0].split()])
+                ID.append(int(point.xpath('attribute::id')[0].strip()))
+                parent.append(int(point.xpath('attribute::parent')[0].strip()))
+            except:
+                continue
+        pos[t] = [x,y,z,svID,ID,parent]
+    return pos
+
+def sameFrames(pos_dom, pos_stream):
+    """
+    Compare the lists of the DOM reader with the
+    columns of the FrameTables of readXMLAmat
+    """
+    if len(pos_dom) != len(pos_stream):
+        return False
+    for (x, y, z, svID, ID, parent), frame in zip(pos_dom, pos_stream):
+        if not (np.array_equal(frame.xyz, np.asarray([x, y, z]).reshape(3, -1)) and
+                frame.ID.tolist() == ID and frame.parent.tolist() == parent and
+                [sv.tolist() for sv in frame.svIDs()] == svID):
+            return False
+
+    return True
+
+def writeSyntheticRun(folder, n_frames, n_nuclei):
+    """
+    Write n_frames XML files with n_nuclei Gaussians each,
+    using the same attributes written by TGMM
+    """
+    xml_path = join(folder, 'GMEMfinalResult_frame????.xml')
+    rnd = np.random.RandomState(0)
+    for t in range(n_frames):
+        lines = ['<?xml version="1.0" encoding="utf-8"?>', '<document>']
+        m = rnd.rand(n_nuclei, 3)*[512, 512, 50]
+        for i in range(n_nuclei):
+            parent = i if t > 0 else -1
+            lines.append('<GaussianMixtureModel id="{0}" lineage="{0}" parent="{1}" '
+                'splitScore="3" scale="1 1 1" nu="128" beta="128" '
+                'm="{2:.6f} {3:.6f} {4:.6f}" W="0.01 0 0 0 0.01 0 0 0 0.01" '
+                'nuPrior="4" betaPrior="0.1" alphaPrior="0" distMRFPrior="0" '
+                'mPrior="0 0 0" WPrior="0.01 0 0 0 0.01 0 0 0 0.01" svIdx="{5} {6}">\n'
+                '</GaussianMixtureModel>'.format(i, parent, m[i,0], m[i,1], m[i,2], 2*i, 2*i+1))
+        lines.append('</document>')
+        with open(corrTIFPath(xml_path, '?', t), 'w') as f:
+            f.write('\n'.join(lines))
+
+    return xml_path
+
+def main(*args):
+
+    n_frames = 20
+    n_nuclei = 10000
+    if len(args) >= 2:
+        n_frames = int(args[0])
+        n_nuclei = int(args[1])
+
+    folder = tempfile.mkdtemp()
+    try:
+        print('Writing %d frames with %d nuclei...'%(n_frames, n_nuclei))
+        xml_path = writeSyntheticRun(folder, n_frames, n_nuclei)
+
+        start = timer()
+        pos_dom = readXMLAmatDOM(xml_path, 0, n_frames-1)
+        time_dom = timer() - start
+
+        start = timer()
+        pos_stream = readXMLAmat(xml_path, 0, n_frames-1)
+        time_stream = timer() - start
+
+        print('Same output: %s'%str(sameFrames(pos_dom, pos_stream)))
+        print('DOM/xpath reader: %.3f s (%.1f ms/frame)'%(time_dom, 1000*time_dom/n_frames))
+        print('Streaming reader: %.3f s (%.1f ms/frame)'%(time_stream, 1000*time_stream/n_frames))
+        print('Speedup: %.2fx'%(time_dom/time_stream))
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# benchmark_track_cells.py
+
+# Compare the array based lineage reconstruction of track_utils
+# with the previous loop of TrackingAnalysis.trackCells on a
+# synthetic run. The previous loop is quadratic in the number of
+# nuclei, so it only runs on the first n_frames_legacy frames.
+# Call: py code_snaps/benchmark_track_cells.py <n_frames> <n_nuclei> <n_frames_legacy>
+
+import numpy as np
+import sys
+from os.path import dirname, abspath
+from timeit import default_timer as timer
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from track_utils import FrameTable, TrackStore, trackFrames
+
+def syntheticFrames(n_frames, n_nuclei, p_division = 0.02, p_death = 0.03, p_new = 0.01):
+    """
+    Random lineages with about n_nuclei per frame (deaths balance
+    divisions and new nuclei). The IDs are shuffled in each frame,
+    as in the TGMM output
+    """
+    rnd = np.random.RandomState(0)
+    frames = []
+    ids = rnd.permutation(n_nuclei)
+    parents = np.full(n_nuclei, -1)
+    for t in range(n_frames):
+        n = ids.shape[0]
+        frames.append(FrameTable(rnd.rand(3, n), ids, parents, np.zeros(n+1), []))
+
+        # each nucleus dies, divides or continues
+        fate = rnd.rand(n)
+        n_children = np.where(fate < p_death, 0, np.where(fate < p_death+p_division, 2, 1))
+        children_parents = np.repeat(ids, n_children)
+        n_new = rnd.poisson(p_new*n)
+        parents = np.concatenate((children_parents, np.full(n_new, -1)))
+        order = rnd.permutation(parents.shape[0])
+        parents = parents[order]
+        ids = rnd.permutation(parents.shape[0])
+
+    return frames
+
+def trackCellsLegacy(frames):
+    """
+    Previous implementation of TrackingAnalysis.trackCells
+    """
+    t_appearance = []
+    id_seq = []
+    division = []
+    dict_track = {0: {}}
+
+    def addTrack(t, id_num):
+        id_seq.append([id_num])
+        t_appearance.append(t)
+        dict_track[t][id_num] = len(id_seq)-1
+
+    for id_num in frames[0].ID.tolist():
+        addTrack(0, id_num)
+
+    for t in range(len(frames)-1):
+        data_t = frames[t+1]
+        dict_track[t+1] = {}
+        parents = data_t.parent.tolist()
+        for cell, id_num in enumerate(data_t.ID.tolist()):
+            parent = parents[cell]
+            if parent == -1:
+                addTrack(t+1, id_num)
+            elif parent in dict_track[t]:
+                index = dict_track[t][parent]
+                if index in dict_track[t+1].values():
+                    parent_id = id_seq[index][-2]
+                    child1_id = id_seq[index][-1]
+                    id_seq[index] = id_seq[index][:-1]
+                    del dict_track[t+1][child1_id]
+                    addTrack(t+1, child1_id)
+                    addTrack(t+1, id_num)
+                    division.append([t+1, parent_id, child1_id, id_num])
+                else:
+                    id_seq[index].append(id_num)
+                    dict_track[t+1][id_num] = index
+
+    return id_seq, t_appearance, division
+
+def trackCellsArrays(frames):
+    """
+    Lineage reconstruction with array operations
+    """
+    frame_ids, frame_tracks, division, lost = trackFrames(frames)
+    tracks = TrackStore.fromFrames(frame_ids, frame_tracks)
+    # group the points by track (built lazily otherwise)
+    tracks._build()
+
+    return tracks, division
+
+def main(*args):
+
+    n_frames = 500
+    n_nuclei = 10000
+    n_frames_legacy = 20
+    if len(args) >= 2:
+        n_frames = int(args[0])
+        n_nuclei = int(args[1])
+    if len(args) >= 3:
+        n_frames_legacy = int(args[2])
+    n_frames_legacy = min(n_frames_legacy, n_frames)
+
+    print('Generating %d frames with %d nuclei...'%(n_frames, n_nuclei))
+    frames = syntheticFrames(n_frames, n_nuclei)
+
+    start = timer()
+    tracks, division = trackCellsArrays(frames)
+    time_arrays = timer() - start
+    print('Array engine, %d frames: %.3f s (%.2f ms/frame), %d tracks, %d divisions'%(
+        n_frames, time_arrays, 1000*time_arrays/n_frames, len(tracks), division.shape[0]))
+
+    if n_frames_legacy > 1:
+        start = timer()
+        out_legacy = trackCellsLegacy(frames[:n_frames_legacy])
+        time_legacy = timer() - start
+        tracks, division = trackCellsArrays(frames[:n_frames_legacy])
+        out_prefix = ([ids.tolist() for ids in tracks], tracks.t_appearance.tolist(), division.tolist())
+
+        print('Same output on the first %d frames: %s'%(n_frames_legacy, str(out_legacy == out_prefix)))
+        print('Previous loop, %d frames: %.3f s (%.2f ms/frame)'%(
+            n_frames_legacy, time_legacy, 1000*time_legacy/n_frames_legacy))
+        print('Speedup per frame: %.1fx'%((time_legacy/n_frames_legacy)/(time_arrays/n_frames)))
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
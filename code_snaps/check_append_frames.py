@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# check_append_frames.py
+
+# Check that a run opened while the tracking software is still
+# writing it, and then extended with appendFrames, gives the same
+# tracks as the whole run opened at once. The partial run is a copy
+# of the results folder with only the first n_partial XMLs.
+# Call: py code_snaps/check_append_frames.py <results_folder> <n_partial>
+
+import numpy as np
+import tempfile
+import shutil
+import glob
+import os
+import sys
+from os.path import join, dirname, abspath, basename
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from track_utils import TrackingAnalysis
+
+XML_FOLDERS = ['XML_finalResult_lht_bckgRm', 'XML_finalResult_lht']
+
+def copyRun(folder, copy, n_frames = None):
+    """
+    Copy the log, the manual tracks and the first n_frames XMLs
+    (None is all) of the results folder
+    """
+    for f_path in glob.glob(join(folder, 'experimentLog_*.txt')):
+        shutil.copy(f_path, copy)
+    if os.path.isdir(join(folder, 'manual_track_config')):
+        shutil.copytree(join(folder, 'manual_track_config'), join(copy, 'manual_track_config'))
+    for xml_folder in XML_FOLDERS:
+        os.makedirs(join(copy, xml_folder))
+        for f_path in sorted(glob.glob(join(folder, xml_folder, '*.xml')))[:n_frames]:
+            shutil.copy(f_path, join(copy, xml_folder))
+
+def copyXMLs(folder, copy):
+    """
+    Copy the XMLs that are not yet in the copy
+    """
+    for xml_folder in XML_FOLDERS:
+        for f_path in sorted(glob.glob(join(folder, xml_folder, '*.xml'))):
+            if not os.path.isfile(join(copy, xml_folder, basename(f_path))):
+                shutil.copy(f_path, join(copy, xml_folder))
+
+def sameTracks(track_a, track_b):
+    """
+    If both analyses have the same frames, tracks and divisions
+    """
+    if track_a.n_frames != track_b.n_frames or len(track_a.tracks) != len(track_b.tracks):
+        return False
+    same_frames = all(np.array_equal(track_a.pos[t].xyz, track_b.pos[t].xyz) and
+        np.array_equal(track_a.tracks.frameTracks(t), track_b.tracks.frameTracks(t))
+        for t in range(track_a.n_frames))
+    same_tracks = all(np.array_equal(a, b) for a, b in zip(track_a.tracks, track_b.tracks))
+
+    return (same_frames and same_tracks and track_a.division == track_b.division and
+        np.array_equal(track_a.tracks.t_appearance, track_b.tracks.t_appearance))
+
+def main(*args):
+
+    if len(args) >= 2:
+        folder = str(args[0])
+        n_partial = int(args[1])
+    else:
+        print('Provide the arguments for the function')
+        print('Call must be: py code_snaps/check_append_frames.py <results_folder> <n_partial>')
+        return None
+
+    copy = tempfile.mkdtemp()
+    try:
+        copyRun(folder, copy, n_partial)
+        track_partial = TrackingAnalysis(copy, use_cache = False)
+        print('Frames opened: %d'%track_partial.n_frames)
+
+        copyXMLs(folder, copy)
+        n_added = track_partial.appendFrames()
+        print('Frames added: %d'%n_added)
+
+        track_full = TrackingAnalysis(copy, use_cache = False)
+        print('Same output: %s'%str(sameTracks(track_partial, track_full)))
+    finally:
+        shutil.rmtree(copy)
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -10,24 +10,6 @@ import os
 from track_utils import *
 from os.path import join
 
-def calcAllPixelsAddress(pixIDList, dimX, dimY):
-
-    ini = True
-    for pixIDs in pixIDList:
-        pixs = np.zeros((pixIDs.shape[0], 3))
-        szFrame = dimX*dimY
-        pixs[:,2] = pixIDs // szFrame
-        pixs[:,1] = (pixIDs % szFrame) // dimX
-        pixs[:,0] = (pixIDs % szFrame) % dimX
-
-        if ini:
-            pixPoints = pixs
-            ini = False
-        else:
-            pixPoints = np.vstack((pixPoints, pixs))
-
-    return pixPoints
-
 def plotAllSV(image_out_path, time, track):
 
     frame = time - track.configs[track.TIME_INI_KEY]
@@ -41,6 +23,9 @@ def plotAllSV(image_out_path, time, track):
     print(len(pixIDList), len(svIDList)) 
     pixPoints = calcAllPixelsAddress(pixIDList, dims[0,0], dims[1,0])
 
+    # pixels sorted by stack, to get each stack without going through all
+    pixSlices = PixelSlices(pixPoints, im_out.shape[0])
+
     n_stacks = im_out.shape[0]
     ax = plt.subplot(1,1,1)
     for stack in range(n_stacks):
@@ -58,7 +43,7 @@ def plotAllSV(image_out_path, time, track):
         pix_x, pix_y = np.meshgrid(np.arange(0,size[1],1), np.arange(0,size[0],1))
 
         # get all coordinates of pixels in this stack
-        sv_pix = pixPoints[np.equal(pixPoints[:,2],stack),:]
+        sv_pix = pixSlices[stack]
         sv_pix = sv_pix.astype(int)
         sv_image = np.zeros((size[0], size[1]))
         sv_image[sv_pix[:,1], sv_pix[:,0]] = 1
@@ -88,7 +73,7 @@ def main(*args):
 
     image_out_path = join(folder,"eye_check","T?????_allSV","Z@@@.png")
 
-    track = TrackingAnalysis(folder)
+    track = TrackingAnalysis(folder, lazy_frames = True)
 
     # Run main file
     plotAllSV(image_out_path, time, track)
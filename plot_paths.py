@@ -25,15 +25,18 @@ def plotTracks3D(track, frame_ini, frame_end):
 
     anisotropy = track.configs[track.ANISOTROPY_KEY]
 
-    for track_index in track.index_filter:
-        # mov is an array (4, time), where 4 is:
-        # 0 -> frame, 1-3 -> x,y,z
-        mov = np.asarray(track.getWholeMovement(track_index))
-        to_include = np.logical_and(
-                     np.greater_equal(mov[0,:], frame_ini),
-                     np.less_equal(mov[0,:], frame_end))
+    # movements is an array (track, time, 3), valid says where each track exists
+    movements, valid = track.getMovements(track.index_filter)
+    frames = np.arange(track.n_frames)
+    in_range = np.logical_and(
+               np.greater_equal(frames, frame_ini),
+               np.less_equal(frames, frame_end))
+
+    for cnt in range(movements.shape[0]):
+        to_include = np.logical_and(valid[cnt], in_range)
         if to_include.sum() > 0:
-            ax.plot(mov[1, to_include], mov[2, to_include], mov[3, to_include])
+            mov = movements[cnt, to_include, :]
+            ax.plot(mov[:, 0], mov[:, 1], mov[:, 2])
 
     plt.show()
 
@@ -123,30 +126,28 @@ def plotTracksCartesian(track, frame_ini, frame_end, annotate = False):
     fig = plt.figure()
     ax = fig.add_subplot(111)
 
-    center_of_mass = np.asarray(track.getCenterOfMass())
+    center_of_mass = np.asarray(track.getCenterOfMass(), dtype = float)
     frames = np.arange(center_of_mass.shape[1])
     c_map = get_cmap(len(track.index_filter))
+
+    # movements is an array (track, time, 3), valid says where each track exists
+    movements, valid = track.getMovements(track.index_filter)
+
+    # subtract the center of mass of each frame from all the tracks
+    movements_com = movements - center_of_mass.T[np.newaxis, :, :]
+
+    # to get only the frames of interest
+    in_range = np.logical_and(
+               np.greater_equal(frames, frame_ini),
+               np.less_equal(frames, frame_end))
     
     for cnt, track_index in enumerate(track.index_filter):
-        # mov is an array (4, time), where 4 is:
-        # 0 -> frame, 1-3 -> x,y,z
-        mov = np.asarray(track.getWholeMovement(track_index))
-        
-        # to get only the frames of interest
-        to_include = np.logical_and(
-                     np.greater_equal(mov[0,:], frame_ini),
-                     np.less_equal(mov[0,:], frame_end))
+        to_include = np.logical_and(valid[cnt], in_range)
 
         n_points = to_include.sum()
         if n_points > 0:
-            # get the center of mass for the desired time frames
-            com = center_of_mass[:, np.in1d(frames,mov[0,:])]
-
-            # subtract the center of mass
-            coord_com = mov[1:4, :] - com
-
             # it needs to be float32 for arctan to work
-            coord_com = coord_com[:,to_include].astype(np.float32)
+            coord_com = movements_com[cnt, to_include, :].T.astype(np.float32)
 
             # convert coordinates to cartesian projection
             angles = np.zeros((2,n_points))
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# track_msd.py
+
+# Mean squared displacement (MSD) of the tracks of a TrackingAnalysis.
+# The MSD of all the lags of a track is computed with FFT correlations,
+# in O(T log T) instead of O(T^2), and the points missing in a track are
+# excluded with a mask. The tracks are processed in batches of similar
+# length, so that each batch is a single FFT of a padded array.
+# Call: py track_msd.py <results_date> <min_frames> <pixel_size> <frame_interval>
+
+import numpy as np
+from track_utils import TrackingAnalysis, readConfigFile
+from os.path import join
+
+def _correlate(a, b, n_fft, n_lags):
+    """
+    Correlation sum_t a(t)*b(t+lag) along the last axis, for
+    the lags 0 to n_lags-1
+    """
+    fa = np.fft.rfft(a, n = n_fft)
+    fb = np.fft.rfft(b, n = n_fft)
+    return np.fft.irfft(np.conj(fa)*fb, n = n_fft)[..., :n_lags]
+
+def msdFFT(xyz, valid):
+    """
+    MSD of a batch of trajectories with the FFT algorithm. For each lag,
+    the squared displacements are averaged over the pairs of points
+    of the trajectory that are both valid, expanding
+    |x(t+lag)-x(t)|^2 = |x(t+lag)|^2 + |x(t)|^2 - 2*x(t).x(t+lag)
+    in correlations of the masked coordinates
+    ---
+    PARAMETERS
+
+    xyz: array (n, T, 3) with the positions of n trajectories
+    valid: boolean array (n, T), False where the point is missing
+
+    OUTPUT
+
+    msd: array (n, T) with the MSD of each lag (nan if no pairs)
+    counts: array (n, T) with the number of pairs of each lag
+    """
+    n_lags = xyz.shape[1]
+    # padding to avoid the circular correlation
+    n_fft = 1
+    while n_fft < 2*n_lags:
+        n_fft *= 2
+
+    mask = valid.astype(np.float64)
+    pos = np.where(valid[..., np.newaxis], xyz, 0.0)
+    sq = (pos**2).sum(axis = 2)
+
+    counts = _correlate(mask, mask, n_fft, n_lags)
+    sums = _correlate(mask, sq, n_fft, n_lags) + _correlate(sq, mask, n_fft, n_lags)
+    for k in range(xyz.shape[2]):
+        sums -= 2*_correlate(pos[..., k], pos[..., k], n_fft, n_lags)
+
+    # the correlations are sums of integers (counts) and positive values
+    counts = np.rint(counts).astype(np.int64)
+    msd = np.full(counts.shape, np.nan)
+    np.divide(sums, counts, out = msd, where = counts > 0)
+    np.maximum(msd, 0, out = msd)
+    # no displacement at lag 0, without the rounding errors
+    msd[counts[:, 0] > 0, 0] = 0.0
+
+    return msd, counts
+
+def _batches(spans, batch_ratio):
+    """
+    Group the indexes of the tracks so that the longest span in
+    each group is at most batch_ratio times the shortest
+    """
+    order = np.argsort(spans, kind = 'mergesort')
+    groups = []
+    ini = 0
+    while ini < order.shape[0]:
+        end = np.searchsorted(spans[order], batch_ratio*spans[order[ini]], side = 'right')
+        groups.append(order[ini:max(end, ini+1)])
+        ini = max(end, ini+1)
+
+    return groups
+
+def trackMSD(track, track_indices = None, pixel_size = 1.0, frame_interval = 1.0, batch_ratio = 2.0):
+    """
+    MSD of each track
+    ---
+    PARAMETERS
+
+    track: TrackingAnalysis
+    track_indices: indexes of the tracks (None is index_filter)
+    pixel_size: XY size of the pixel. The z axis is scaled by the
+    anisotropy (see TrackingAnalysis.trackFeatures)
+    frame_interval: time between frames
+    batch_ratio: maximum ratio between the lengths of the tracks
+    computed together
+
+    OUTPUT
+
+    lags: list with the lag times (0, frame_interval, ...) of each track
+    msd: list with the MSD of each lag of each track
+    counts: list with the number of pairs used for each lag
+    """
+    if track_indices is None:
+        track_indices = track.index_filter
+    track_indices = np.asarray(track_indices, dtype = np.int64)
+
+    start = track.tracks.t_appearance[track_indices]
+    spans = track.tracks.lengths()[track_indices]
+    scale = pixel_size*np.array([1.0, 1.0, track.configs[track.ANISOTROPY_KEY]])
+
+    lags = [None,]*track_indices.shape[0]
+    msd = [None,]*track_indices.shape[0]
+    counts = [None,]*track_indices.shape[0]
+    for batch in _batches(spans, batch_ratio):
+        movements, valid = track.getMovements(track_indices[batch])
+
+        # trajectories in the time of each track, padded to the longest
+        n_lags = int(spans[batch].max())
+        frames = start[batch][:, np.newaxis] + np.arange(n_lags)
+        inside = frames < movements.shape[1]
+        frames = np.minimum(frames, movements.shape[1]-1)
+        rows = np.arange(len(batch))[:, np.newaxis]
+        batch_valid = valid[rows, frames] & inside
+        batch_xyz = movements[rows, frames, :]*scale
+
+        batch_msd, batch_counts = msdFFT(batch_xyz, batch_valid)
+        for cnt, i in enumerate(batch.tolist()):
+            msd[i] = batch_msd[cnt, :spans[i]]
+            counts[i] = batch_counts[cnt, :spans[i]]
+            lags[i] = frame_interval*np.arange(spans[i])
+
+    return lags, msd, counts
+
+def ensembleMSD(track, track_indices = None, pixel_size = 1.0, frame_interval = 1.0, batch_ratio = 2.0):
+    """
+    MSD of all the tracks together, weighting each track by the
+    number of pairs of points of each lag (see trackMSD)
+    ---
+    OUTPUT
+
+    lags: lag times
+    msd: MSD of each lag
+    counts: number of pairs of each lag
+    """
+    lags, msd, counts = trackMSD(track, track_indices, pixel_size, frame_interval, batch_ratio)
+    n_lags = max([len(m) for m in msd] + [0])
+
+    sums = np.zeros(n_lags)
+    total = np.zeros(n_lags, dtype = np.int64)
+    for m, c in zip(msd, counts):
+        sums[:len(m)] += np.where(c > 0, m*c, 0)
+        total[:len(c)] += c
+
+    out = np.full(n_lags, np.nan)
+    np.divide(sums, total, out = out, where = total > 0)
+
+    return frame_interval*np.arange(n_lags), out, total
+
+def main(*args):
+
+    if len(args) >= 1:
+        date = str(args[0])
+    else:
+        print('Provide the arguments for the function')
+        print('Call must be: py track_msd.py <results_date> <min_frames> <pixel_size> <frame_interval>')
+        return None
+
+    min_frames = 2
+    pixel_size = 1.0
+    frame_interval = 1.0
+    if len(args) > 1:
+        min_frames = int(args[1])
+    if len(args) > 2:
+        pixel_size = float(args[2])
+    if len(args) > 3:
+        frame_interval = float(args[3])
+
+    ini_config = readConfigFile(join('ini_files', 'ini_config.ini'))
+    results_folder = ini_config['results_folder']
+    folder =  join(results_folder,"GMEMtracking3D_" + date)
+
+    track = TrackingAnalysis(folder)
+    track.minFrameFilter(min_frames, keep_previous = False)
+
+    # Write the ensemble MSD
+    lags, msd, counts = ensembleMSD(track, pixel_size = pixel_size, frame_interval = frame_interval)
+    f = open(join(folder, "msd.txt"), 'w')
+    f.write('lag\tmsd\tcount\n')
+    for lag, value, count in zip(lags.tolist(), msd.tolist(), counts.tolist()):
+        f.write('{lag}\t{msd}\t{count}\n'.format(lag = lag, msd = value, count = count))
+    f.close()
+
+if __name__ == "__main__":
+    import sys
+    main(*sys.argv[1:])
@@ -10,7 +10,20 @@ import tifffile as tff
 import lxml.etree as etree
 import struct
 import os
+import mmap
+import multiprocessing
+import collections
 from os.path import join
+from scipy.spatial import cKDTree
+
+# h5py is only needed to export and load runs in HDF5
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# Version of the format of the binary cache files
+CACHE_VERSION = 6
 
 def readConfigFile(path):
     """
@@ -86,7 +99,509 @@ def readManualTrackFile(filename):
 
     return out
 
-def readXMLAmat(filename, time_ini, time_end, symbol = '?'):
+class FrameTable(object):
+    """
+    Points of a single time frame stored as contiguous arrays.
+    For backward compatibility, table[k] gives the column k of the
+    general indexed list [x,y,z,svID,ID,parent] of readXMLAmat.
+    ---
+    PARAMETERS
+
+    xyz: (3, n_points) coordinates of the points
+    ID: ID of each point in the XML
+    parent: ID of the parent of each point in the previous frame
+    sv_offsets, sv_values: the supervoxel IDs of the point i are
+    sv_values[sv_offsets[i]:sv_offsets[i+1]]
+    """
+    def __init__(self, xyz, ID, parent, sv_offsets, sv_values):
+        """
+        Constructor
+        """
+        self.xyz = np.asarray(xyz, dtype = np.float64).reshape(3, -1)
+        self.ID = np.asarray(ID, dtype = np.int32)
+        self.parent = np.asarray(parent, dtype = np.int32)
+        self.sv_offsets = np.asarray(sv_offsets, dtype = np.int64)
+        self.sv_values = np.asarray(sv_values, dtype = np.int32)
+
+        # index ID -> row, by binary search in the sorted IDs
+        self._id_order = np.argsort(self.ID, kind = 'mergesort').astype(np.int32)
+        self._sorted_ids = self.ID[self._id_order]
+
+    @classmethod
+    def fromLists(cls, x, y, z, svID, ID, parent):
+        """
+        Build the table from the lists [x,y,z,svID,ID,parent]
+        """
+        sv_offsets = np.zeros(len(svID)+1, dtype = np.int64)
+        sv_offsets[1:] = np.cumsum([len(svs) for svs in svID])
+        sv_values = [sv for svs in svID for sv in svs]
+
+        return cls([x, y, z], ID, parent, sv_offsets, sv_values)
+
+    @property
+    def n_points(self):
+        return self.ID.shape[0]
+
+    def nbytes(self):
+        """
+        Memory allocated by the arrays of the table. The arrays
+        mapped from a file (see readXMLAmatFrameCached) are not counted, 
+        their pages are kept or dropped by the OS
+        """
+        arrays = [self.xyz, self.ID, self.parent, self.sv_offsets, 
+            self.sv_values, self._id_order, self._sorted_ids]
+        return sum(array.nbytes for array in arrays if not _isMapped(array))
+
+    def rows(self, ids):
+        """
+        Rows of the points with the given IDs, -1 for the IDs
+        that are not in the frame
+        """
+        ids = np.asarray(ids, dtype = np.int64)
+        pos = np.searchsorted(self._sorted_ids, ids)
+        pos = np.minimum(pos, max(self.n_points-1, 0))
+        out = np.full(ids.shape, -1, dtype = np.int64)
+        if self.n_points > 0:
+            found = self._sorted_ids[pos] == ids
+            out[found] = self._id_order[pos[found]]
+
+        return out
+
+    def row(self, id_num):
+        """
+        Row of the point with ID id_num (None if it is not in the frame)
+        """
+        row = int(self.rows(id_num))
+        return row if row >= 0 else None
+
+    def svIDs(self, rows = None):
+        """
+        List with the supervoxel IDs array of each point in rows
+        (all the points if rows is None)
+        """
+        if rows is None:
+            rows = range(self.n_points)
+        offsets = self.sv_offsets
+        return [self.sv_values[offsets[row]:offsets[row+1]] for row in rows]
+
+    def __len__(self):
+        return 6
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            columns = range(6)[k]
+            if len(columns) > 0 and columns[-1] < 3:
+                # only coordinates, no copy needed
+                return self.xyz[k]
+            return [self[column] for column in columns]
+
+        if k < 0:
+            k += 6
+        if k in (0, 1, 2):
+            return self.xyz[k]
+        elif k == 3:
+            return self.svIDs()
+        elif k == 4:
+            return self.ID
+        elif k == 5:
+            return self.parent
+        raise IndexError('FrameTable has only 6 columns')
+
+def _parseXMLAmatFrame(filename):
+    """
+    Parse the XML of a single time frame. Returns the FrameTable
+    and the IDs of the corrupted points, so the warnings can be
+    reported by the caller (also when running in a process pool).
+    """
+    x = []
+    y = []
+    z = []
+    sv_counts = []
+    sv_values = []
+    ID = []
+    parent = []
+    corrupted = []
+    for _, point in etree.iterparse(filename, events = ('end',), tag = 'GaussianMixtureModel'):
+        attrib = point.attrib
+        # Needs try catch to avoid the errors in XML
+        try:
+            [x_aux, y_aux, z_aux] = [float(a) for a in attrib['m'].split()]
+            sv_aux = [int(a) for a in attrib['svIdx'].split()]
+            id_aux = int(attrib['id'])
+            parent_aux = int(attrib['parent'])
+        except (KeyError, ValueError):
+            corrupted.append(attrib.get('id', '?').strip())
+        else:
+            x.append(x_aux)
+            y.append(y_aux)
+            z.append(z_aux)
+            sv_counts.append(len(sv_aux))
+            sv_values.extend(sv_aux)
+            ID.append(id_aux)
+            parent.append(parent_aux)
+
+        # free the memory of the points already read
+        point.clear()
+        while point.getprevious() is not None:
+            del point.getparent()[0]
+
+    sv_offsets = np.zeros(len(sv_counts)+1, dtype = np.int64)
+    sv_offsets[1:] = np.cumsum(sv_counts)
+
+    return FrameTable([x, y, z], ID, parent, sv_offsets, sv_values), corrupted
+
+def _printCorruptedPoints(filename, corrupted):
+    """
+    Warn about the points that could not be read
+    """
+    for p_id in corrupted:
+        print('Point ID {p_id} in file {f_path} is corrupted'.format(
+                f_path = filename, p_id = p_id))
+
+def readXMLAmatFrame(filename):
+    """
+    Reads the XML of a single time frame generated by the tracking
+    software described by Amat et al., Nature methods, 11, 2014.
+    The file is streamed with iterparse and every Gaussian is
+    cleared after being read, so the whole tree is never in memory.
+    ---
+    PARAMETERS
+
+    filename: path of the XML file of the frame
+
+    OUTPUT
+
+    frame: FrameTable with the points of the frame
+    """
+    frame, corrupted = _parseXMLAmatFrame(filename)
+    _printCorruptedPoints(filename, corrupted)
+
+    return frame
+
+def xmlAmatPaths(filename, time_ini, time_end, symbol = '?'):
+    """
+    List of the XML paths of each time frame
+    """
+    return [corrTIFPath(filename, symbol, time_path) 
+        for time_path in range(time_ini, time_end+1, 1)]
+
+def completeXMLAmatFrames(filename, time_ini, time_end, symbol = '?'):
+    """
+    Number of frames from time_ini whose XML is already complete, for a
+    run that the tracking software is still writing (time_end is the
+    planned last frame). The XMLs are written in order, so they are 
+    counted until the first one missing, and the last one is parsed
+    to check that it is not still being written (see appendFrames)
+    """
+    paths = xmlAmatPaths(filename, time_ini, time_end, symbol)
+    n_frames = 0
+    while n_frames < len(paths) and os.path.isfile(paths[n_frames]):
+        n_frames += 1
+
+    if n_frames > 0:
+        try:
+            for _, element in etree.iterparse(paths[n_frames-1], events = ('end',)):
+                element.clear()
+        except etree.XMLSyntaxError:
+            # file still being written
+            n_frames -= 1
+
+    return n_frames
+
+def fileKey(path):
+    """
+    Size and modification time of the file, used to check
+    if a cached result of the file is still valid
+    """
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def _isMapped(array):
+    """
+    If the array is a view of a memory-mapped file
+    """
+    base = array
+    while isinstance(base, np.ndarray):
+        base = base.base
+
+    return isinstance(base, mmap.mmap)
+
+def _packFrames(frames):
+    """
+    Pack a list of FrameTables in flat arrays. Frame t is in the
+    rows frame_offsets[t]:frame_offsets[t+1] and the supervoxels 
+    of row i are sv_values[sv_offsets[i]:sv_offsets[i+1]]
+    """
+    n_points = [frame.n_points for frame in frames]
+    sv_shift = np.cumsum([0] + [frame.sv_offsets[-1] for frame in frames])
+
+    out = {}
+    out['frame_offsets'] = np.concatenate(([0], np.cumsum(n_points))).astype(np.int64)
+    out['xyz'] = np.concatenate([np.zeros((3,0))] + [frame.xyz for frame in frames], axis = 1)
+    out['ID'] = np.concatenate([np.zeros(0, np.int32)] + [frame.ID for frame in frames])
+    out['parent'] = np.concatenate([np.zeros(0, np.int32)] + [frame.parent for frame in frames])
+    out['sv_offsets'] = np.concatenate([frame.sv_offsets[:-1] + shift 
+        for frame, shift in zip(frames, sv_shift)] + [sv_shift[-1:]]).astype(np.int64)
+    out['sv_values'] = np.concatenate([np.zeros(0, np.int32)] + [frame.sv_values for frame in frames])
+
+    return out
+
+def _unpackFrame(packed, t):
+    """
+    Get the FrameTable of frame t from the packed arrays.
+    The columns are views of the packed arrays
+    """
+    ini, end = packed['frame_offsets'][t:t+2]
+    sv_offsets = packed['sv_offsets'][ini:end+1]
+
+    return FrameTable(packed['xyz'][:,ini:end], packed['ID'][ini:end], 
+        packed['parent'][ini:end], sv_offsets - sv_offsets[0], 
+        packed['sv_values'][sv_offsets[0]:sv_offsets[-1]])
+
+def _loadNpz(path):
+    """
+    Load all the arrays of a npz file in a dictionary.
+    Returns None if the file does not exist, cannot be read
+    or was written with another version of the cache
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        with np.load(path) as data:
+            out = {name: data[name] for name in data.files}
+    except (IOError, ValueError):
+        print('WARNING! Cache file %s could not be read and will be rebuilt.'%path)
+        return None
+
+    if out.get('version') != CACHE_VERSION:
+        return None
+
+    return out
+
+def _saveNpz(path, arrays):
+    """
+    Save the arrays in a npz file. The file is first written in a 
+    temporary file, so a broken write never replaces a valid cache
+    """
+    try:
+        ensure_dir(path)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, version = CACHE_VERSION, **arrays)
+        os.replace(path + '.tmp', path)
+    except (IOError, OSError):
+        print('WARNING! Cache file %s could not be written.'%path)
+        return False
+
+    return True
+
+def _parseXMLAmatFrames(paths, workers = 1):
+    """
+    Parse the XMLs in paths, using a process pool if workers > 1.
+    Returns the FrameTable and the IDs of the corrupted points of
+    each XML (see _parseXMLAmatFrame)
+    """
+    if workers > 1 and len(paths) > 1:
+        # map keeps the results in frame order
+        with multiprocessing.Pool(min(workers, len(paths))) as pool:
+            return pool.map(_parseXMLAmatFrame, paths)
+
+    return [_parseXMLAmatFrame(path) for path in paths]
+
+def _frameCachePath(folder, path):
+    """
+    Cache file in folder of the frame of the XML path
+    """
+    return join(folder, os.path.splitext(os.path.basename(path))[0] + '.bin')
+
+# Columns of the frame cache files, in the order of the file
+_FRAME_COLUMNS = [('xyz', np.float64), ('ID', np.int32), ('parent', np.int32), 
+    ('sv_offsets', np.int64), ('sv_values', np.int32)]
+
+def _saveFrameCache(cache_file, frame, key, corrupted):
+    """
+    Write the frame in its cache file: a header [version, size, mtime, 
+    n_points, n_sv, n_corrupted] (int64) with the key of the XML, the
+    IDs of the corrupted points (int64), so their warnings are given
+    again, and the columns of the FrameTable. The file is first written
+    in a temporary file, so a broken write never replaces a valid cache
+    """
+    header = np.asarray([CACHE_VERSION] + list(key) + [frame.n_points, 
+        int(frame.sv_offsets[-1]), len(corrupted)], dtype = np.int64)
+    try:
+        ensure_dir(cache_file)
+        with open(cache_file + '.tmp', 'wb') as f:
+            f.write(header.tobytes())
+            f.write(np.asarray(corrupted, dtype = np.int64).tobytes())
+            for name, dtype in _FRAME_COLUMNS:
+                f.write(np.ascontiguousarray(getattr(frame, name), dtype = dtype).tobytes())
+        os.replace(cache_file + '.tmp', cache_file)
+    except (IOError, OSError):
+        print('WARNING! Cache file %s could not be written.'%cache_file)
+        return False
+
+    return True
+
+def _loadFrameCache(cache_file, key, mmap = True):
+    """
+    Frame of a cache file written by _saveFrameCache, with the columns
+    memory-mapped (or read in memory if not mmap), and the IDs of the 
+    corrupted points. Returns None if the file does not exist, cannot
+    be read or is not of this key and version
+    """
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        if mmap:
+            data = np.memmap(cache_file, dtype = np.uint8, mode = 'r')
+        else:
+            data = np.fromfile(cache_file, dtype = np.uint8)
+        header = data[:48].view(np.int64).tolist()
+        if header[:3] != [CACHE_VERSION] + list(key):
+            return None
+        n_points, n_sv, n_corrupted = header[3:]
+        corrupted = data[48:48+8*n_corrupted].view(np.int64).tolist()
+        counts = {'xyz': 3*n_points, 'ID': n_points, 'parent': n_points, 
+            'sv_offsets': n_points+1, 'sv_values': n_sv}
+        # sv_offsets starts after 32*n_points bytes of columns, so all of them are aligned
+        columns = {}
+        ini = 48 + 8*n_corrupted
+        for name, dtype in _FRAME_COLUMNS:
+            end = ini + counts[name]*np.dtype(dtype).itemsize
+            columns[name] = data[ini:end].view(dtype)
+            ini = end
+        if ini != data.shape[0]:
+            raise ValueError('Truncated file')
+    except (IOError, ValueError):
+        print('WARNING! Cache file %s could not be read and will be rebuilt.'%cache_file)
+        return None
+
+    frame = FrameTable(columns['xyz'].reshape(3, n_points), columns['ID'], 
+        columns['parent'], columns['sv_offsets'], columns['sv_values'])
+
+    return frame, corrupted
+
+def readXMLAmatFrameCached(filename, cache_folder, mmap = True):
+    """
+    Same as readXMLAmatFrame, but the frame is kept in a cache file in
+    cache_folder (one file per frame), and the XML is only parsed again
+    if it changed (size or modification time). With mmap, the columns
+    of a cached frame are memory-mapped from the cache file. The
+    warnings of the corrupted points are also given for a cached frame
+    """
+    key = fileKey(filename)
+    cache_file = _frameCachePath(cache_folder, filename)
+    result = _loadFrameCache(cache_file, key, mmap)
+    if result is None:
+        result = _parseXMLAmatFrame(filename)
+        _saveFrameCache(cache_file, result[0], key, result[1])
+    frame, corrupted = result
+    _printCorruptedPoints(filename, corrupted)
+
+    return frame
+
+def readXMLAmatPacked(filename, time_ini, time_end, symbol = '?', workers = 1, cache_path = None):
+    """
+    Same as readXMLAmat, but the output is packed in flat arrays
+    (see _packFrames).
+    """
+    return _packFrames(readXMLAmat(filename, time_ini, time_end, symbol, workers, cache_path))
+
+def _spillArrays(folder, arrays):
+    """
+    Write the arrays as .npy files in folder and open them
+    memory-mapped
+    """
+    ensure_dir(join(folder, ''))
+    out = {}
+    for name, data in arrays.items():
+        # new file, in case the previous one is still mapped
+        path = join(folder, name + '.npy')
+        np.save(path + '.tmp.npy', np.asarray(data))
+        os.replace(path + '.tmp.npy', path)
+        out[name] = np.load(path, mmap_mode = 'r')
+
+    return out
+
+def _openRaw(path, dtype, shape):
+    """
+    Open a raw binary file as a read only memory-mapped array
+    """
+    if np.prod(shape) == 0:
+        return np.zeros(shape, dtype = dtype)
+    return np.memmap(path, dtype = dtype, mode = 'r', shape = shape)
+
+def _emptyArrays(folder, specs):
+    """
+    Arrays with the (shape, dtype) of specs, in memory if folder is None, 
+    or in new .npy files of folder, so that they can be filled part by 
+    part without being in memory (see _closeArrays)
+    """
+    if folder is None:
+        return {name: np.empty(shape, dtype = dtype) for name, (shape, dtype) in specs.items()}
+
+    # new files, in case the previous ones are still mapped
+    ensure_dir(join(folder, ''))
+    return {name: np.lib.format.open_memmap(join(folder, name + '.npy.tmp.npy'), mode = 'w+', 
+        dtype = dtype, shape = shape) for name, (shape, dtype) in specs.items()}
+
+def _closeArrays(folder, arrays):
+    """
+    Finish the arrays of _emptyArrays. In a folder, the files are
+    moved in place and opened again read only
+    """
+    if folder is None:
+        return arrays
+
+    out = {}
+    for name in list(arrays.keys()):
+        arrays.pop(name).flush()
+        path = join(folder, name + '.npy')
+        os.replace(path + '.tmp.npy', path)
+        out[name] = np.load(path, mmap_mode = 'r')
+
+    return out
+
+def _loadNpyFolder(folder):
+    """
+    Open memory-mapped the arrays of a folder written by _saveNpyFolder.
+    Returns None if the folder does not exist, was not completely 
+    written or was written with another version of the cache
+    """
+    version_path = join(folder, 'version.npy')
+    if not os.path.isfile(version_path):
+        return None
+    try:
+        if int(np.load(version_path)) != CACHE_VERSION:
+            return None
+        out = {}
+        for name in os.listdir(folder):
+            if name.endswith('.npy') and not '.tmp' in name and name != 'version.npy':
+                out[name[:-4]] = np.load(join(folder, name), mmap_mode = 'r')
+    except (IOError, ValueError):
+        print('WARNING! Cache folder %s could not be read and will be rebuilt.'%folder)
+        return None
+
+    return out
+
+def _saveNpyFolder(folder, arrays):
+    """
+    Save the arrays as .npy files in folder, that can be opened
+    memory-mapped with _loadNpyFolder. The version is written last,
+    as a mark of a complete write
+    """
+    version_path = join(folder, 'version.npy')
+    try:
+        if os.path.isfile(version_path):
+            os.remove(version_path)
+        _spillArrays(folder, arrays)
+        np.save(version_path, np.asarray(CACHE_VERSION))
+    except (IOError, OSError):
+        print('WARNING! Cache folder %s could not be written.'%folder)
+        return False
+
+    return True
+
+def readXMLAmat(filename, time_ini, time_end, symbol = '?', workers = 1, cache_path = None):
     """
     Reads the XML generated by the tracking software described by
     Amat et al., Nature methods, 11, 2014.
@@ -98,45 +613,737 @@ def readXMLAmat(filename, time_ini, time_end, symbol = '?'):
     time_ini: number of the initial frame
     time_end: number of the final frame
     symbol: symbol used in the filename pattern
+    workers: number of processes used to parse the frames
+    cache_path: folder with the frames already parsed, one file per frame
+    with the key of its XML (see readXMLAmatFrameCached). Only the frames
+    whose XML changed (size or modification time) are parsed again
 
     OUTPUT
 
-    pos: general indexed list, with the following data
+    pos: list with the FrameTable of each frame. Each table is
+    also a general indexed list, with the following data
         0,1,2 -> point coordinates
         3 -> SuperVoxel ID
         4 -> ID
         5 -> Parent
     """
-    # Number of parameters to be read. Today is 6.
-    n_param_read = 6
-    pos = [[[],]*n_param_read,]*(time_end-time_ini+1)
-    for t, time_path in enumerate(range(time_ini, time_end+1, 1)):
-        xml_path_corr = corrTIFPath(filename, symbol, time_path)
-        tree = etree.parse(xml_path_corr)
-        root = tree.getroot()
-        all_points = root.xpath('GaussianMixtureModel')
-        x = []
-        y = []
-        z = []
-        svID = []
-        ID = []
-        parent = []
-        for point in all_points:
-            # Needs try catch to avoid the errors in XML
-            try:
-                [x_aux, y_aux, z_aux] = [float(x) for x in point.xpath('attribute::m')[0].split()]
-                x.append(x_aux)
-                y.append(y_aux)
-                z.append(z_aux)
-                svID.append([int(a) for a in point.xpath('attribute::svIdx')[0].split()])
-                ID.append(int(point.xpath('attribute::id')[0].strip()))
-                parent.append(int(point.xpath('attribute::parent')[0].strip()))
-            except:
-                print('Point ID {p_id} in file {f_path} is corrupted'.format( 
-                        f_path = xml_path_corr, p_id = int(point.xpath('attribute::id')[0].strip())))
-                continue
-        pos[t] = [x,y,z,svID,ID,parent]
-    return pos
+    paths = xmlAmatPaths(filename, time_ini, time_end, symbol)
+    if cache_path is None:
+        results = _parseXMLAmatFrames(paths, workers)
+    else:
+        # the keys are taken before parsing, a XML changed meanwhile is parsed again next time
+        keys = [fileKey(path) for path in paths]
+        results = [_loadFrameCache(_frameCachePath(cache_path, path), key, mmap = False) 
+            for path, key in zip(paths, keys)]
+
+        to_parse = [t for t in range(len(paths)) if results[t] is None]
+        for t, result in zip(to_parse, _parseXMLAmatFrames([paths[t] for t in to_parse], workers)):
+            _saveFrameCache(_frameCachePath(cache_path, paths[t]), result[0], keys[t], result[1])
+            results[t] = result
+
+    # the warnings of the corrupted points per file, also for the cached frames
+    frames = [None,]*len(paths)
+    for t, (frame, corrupted) in enumerate(results):
+        _printCorruptedPoints(paths[t], corrupted)
+        frames[t] = frame
+
+    return frames
+
+class LazyFrames(object):
+    """
+    List-like container of the FrameTables of a run (see readXMLAmat).
+    A frame is only read the first time it is accessed, and the frames
+    in memory are kept in a LRU that drops the least recently used
+    frames when the memory budget is exceeded.
+    ---
+    PARAMETERS
+
+    paths: XML path of each frame
+    max_memory: memory budget of the frames in bytes (None is unlimited)
+    packed (optional): flat arrays of all the frames (see readXMLAmatPacked)
+    to be used instead of the XMLs
+    cache_folder (optional): folder of the frame cache files (see
+    readXMLAmatFrameCached). The frames are memory-mapped from it, and
+    the mapped columns are not counted in the budget
+    """
+    def __init__(self, paths, max_memory = None, packed = None, cache_folder = None):
+        """
+        Constructor
+        """
+        self.paths = paths
+        self.max_memory = max_memory
+        self.cache_folder = cache_folder
+        self._packed = packed
+        self._frames = collections.OrderedDict()
+        self._memory = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        for t in range(len(self)):
+            yield self[t]
+
+    def __getitem__(self, t):
+        if isinstance(t, slice):
+            return [self[i] for i in range(*t.indices(len(self)))]
+        if t < 0:
+            t += len(self)
+
+        if t in self._frames:
+            # most recently used goes to the end
+            self._frames.move_to_end(t)
+            return self._frames[t]
+
+        if self._packed is not None and t < len(self._packed['frame_offsets'])-1:
+            frame = _unpackFrame(self._packed, t)
+        elif self.cache_folder is not None:
+            frame = readXMLAmatFrameCached(self.paths[t], self.cache_folder)
+        else:
+            frame = readXMLAmatFrame(self.paths[t])
+
+        self._keep(t, frame)
+
+        return frame
+
+    def append(self, path, frame = None):
+        """
+        Add a new frame at the end. If the frame was already read, it
+        enters the LRU, otherwise it is read from path when accessed
+        """
+        self.paths.append(path)
+        if frame is not None:
+            self._keep(len(self.paths)-1, frame)
+
+    def _keep(self, t, frame):
+        """
+        Put the frame in the LRU
+        """
+        self._frames[t] = frame
+        self._memory[t] = frame.nbytes()
+        self._evict()
+
+    def memory(self):
+        """
+        Memory allocated by the frames in the LRU (see FrameTable.nbytes)
+        """
+        return sum(self._memory.values())
+
+    def _evict(self):
+        """
+        Drop the least recently used frames (never the last one
+        accessed) until the memory is below the budget
+        """
+        if self.max_memory is None:
+            return
+        while len(self._frames) > 1 and self.memory() > self.max_memory:
+            t, _ = self._frames.popitem(last = False)
+            del self._memory[t]
+
+def linkFrame(prev_frame, prev_tracks, frame, n_tracks):
+    """
+    Link the points of a frame to the tracks of the previous frame,
+    following the parent of each point. The rules are the ones of
+    TrackingAnalysis.trackCells, applied with array operations:
+    - a point without parent (-1) starts a new track;
+    - the first child of a parent continues the parent track;
+    - the second child makes a division, the parent track stops and
+    both children start new tracks (in this order);
+    - a third child continues the parent track again, and so on;
+    - a point whose parent is not tracked in the previous frame is lost.
+    New tracks are numbered in the order of the points in the frame.
+    ---
+    PARAMETERS
+
+    prev_frame: FrameTable of the previous frame
+    prev_tracks: track index of each point of prev_frame (-1 if lost)
+    frame: FrameTable of the frame to link
+    n_tracks: number of tracks before this frame
+
+    OUTPUT
+
+    tracks: track index of each point of frame (-1 if lost)
+    n_tracks: number of tracks after this frame
+    division: array (n_divisions, 3) with parent_id, child1_id, child2_id
+    lost: rows of the points that lost track
+    """
+    n_points = frame.n_points
+    parents = frame.parent.astype(np.int64)
+    prev_tracks = np.asarray(prev_tracks, dtype = np.int64)
+
+    # track of the parent of each point (-1 if none)
+    parent_track = np.full(n_points, -1, dtype = np.int64)
+    has_parent = parents != -1
+    rows = prev_frame.rows(parents[has_parent])
+    # row -1 (parent not found) takes the padded -1, also if prev_frame is empty
+    parent_track[has_parent] = np.append(prev_tracks, -1)[rows]
+    linked = parent_track >= 0
+
+    # rank of each point among the children of the same parent track
+    sorted_rows = np.flatnonzero(linked)
+    sorted_rows = sorted_rows[np.argsort(parent_track[sorted_rows], kind = 'mergesort')]
+    sorted_tracks = parent_track[sorted_rows]
+    position = np.arange(sorted_rows.shape[0])
+    is_first = np.ones(sorted_rows.shape[0], dtype = bool)
+    is_first[1:] = sorted_tracks[1:] != sorted_tracks[:-1]
+    first = np.maximum.accumulate(np.where(is_first, position, 0)) if sorted_rows.shape[0] else position
+    is_last = np.ones(sorted_rows.shape[0], dtype = bool)
+    is_last[:-1] = is_first[1:]
+    rank = position - first
+
+    # odd children divide with the previous child, the last even child continues
+    divides_sorted = rank % 2 == 1
+    continues = sorted_rows[np.logical_and(~divides_sorted, is_last)]
+    order = np.argsort(sorted_rows[divides_sorted], kind = 'mergesort')
+    child2 = sorted_rows[divides_sorted][order]
+    child1 = sorted_rows[np.flatnonzero(divides_sorted)-1][order]
+
+    # number of new tracks started by each point, in the frame order
+    new = ~has_parent
+    n_new = new.astype(np.int64)
+    n_new[child2] = 2
+    first_new = n_tracks + np.cumsum(n_new) - n_new
+
+    tracks = np.full(n_points, -1, dtype = np.int64)
+    tracks[new] = first_new[new]
+    tracks[child1] = first_new[child2]
+    tracks[child2] = first_new[child2] + 1
+    tracks[continues] = parent_track[continues]
+
+    division = np.stack((parents[child2], frame.ID[child1], frame.ID[child2]), axis = 1)
+    lost = np.flatnonzero(np.logical_and(has_parent, ~linked))
+
+    return tracks, n_tracks + int(n_new.sum()), division, lost
+
+def _printLostTracks(lost, time_ini = 0):
+    """
+    Warn about the points that lost track, given as rows [t, ID]
+    with the frame of the point (see trackFrames)
+    """
+    for t, id_num in lost.tolist():
+        # weird things happened!
+        print("Warning! Time %s, Cell ID %s lost track"%(str(t-1+time_ini), str(id_num)))
+
+def linkFrames(frames, time_ini = 0):
+    """
+    Follow the points through all the frames (see linkFrame), a frame
+    at a time, so that only the previous frame is kept in memory.
+    ---
+    PARAMETERS
+
+    frames: list-like with the FrameTable of each frame
+    time_ini: number of the first frame, used in the warnings
+
+    OUTPUT
+
+    generator of (ids, tracks, n_tracks, division, lost) for each frame, 
+    with the IDs of the points, their track index (-1 if lost), the
+    number of tracks so far, the divisions as an array (n_divisions, 4)
+    with t, parent_id, child1_id, child2_id and the points that lost 
+    track as an array (n_lost, 2) with t and ID
+    """
+    prev_frame = None
+    for t in range(len(frames)):
+        frame = frames[t]
+        if prev_frame is None:
+            # Initialize points with first frame
+            tracks = np.arange(frame.n_points, dtype = np.int64)
+            n_tracks = frame.n_points
+            division = np.zeros((0, 4), dtype = np.int64)
+            lost = np.zeros((0, 2), dtype = np.int64)
+        else:
+            tracks, n_tracks, division, lost = linkFrame(prev_frame, prev_tracks, frame, n_tracks)
+            division = np.concatenate((np.full((division.shape[0], 1), t), division), axis = 1).astype(np.int64)
+            lost = np.stack((np.full(lost.shape[0], t), frame.ID[lost]), axis = 1).astype(np.int64)
+            _printLostTracks(lost, time_ini)
+        yield frame.ID, tracks, n_tracks, division, lost
+        prev_frame = frame
+        prev_tracks = tracks
+
+def trackFrames(frames, time_ini = 0):
+    """
+    Follow the points through all the frames (see linkFrames).
+    ---
+    PARAMETERS
+
+    frames: list-like with the FrameTable of each frame
+    time_ini: number of the first frame, used in the warnings
+
+    OUTPUT
+
+    frame_ids: list with the IDs of the points of each frame, so that
+    the frames do not need to be read again (see TrackStore.fromFrames)
+    frame_tracks: list with the track index of each point of each 
+    frame (-1 if lost)
+    division: array (n_divisions, 4) with t, parent_id, child1_id, child2_id
+    lost: array (n_lost, 2) with the t and ID of the points that lost
+    track, so that the warnings can be given again (see _printLostTracks)
+    """
+    frame_ids = []
+    frame_tracks = []
+    divisions = [np.zeros((0, 4), dtype = np.int64)]
+    losts = [np.zeros((0, 2), dtype = np.int64)]
+    for ids, tracks, n_tracks, division, lost in linkFrames(frames, time_ini):
+        frame_ids.append(ids)
+        frame_tracks.append(tracks)
+        divisions.append(division)
+        losts.append(lost)
+
+    return frame_ids, frame_tracks, np.concatenate(divisions), np.concatenate(losts)
+
+class TrackStore(object):
+    """
+    Array based store of the tracks. The points are kept per frame,
+    with the XML ID and the track index (-1 if lost) of each row, and
+    are grouped by track in CSR form: the points of track i are
+    offsets[i]:offsets[i+1] of the flat arrays frame, ID and row,
+    in time order. The CSR arrays are built again only when
+    needed after new frames are added.
+    ---
+    PARAMETERS
+
+    folder (optional): folder where the arrays are kept in memory-mapped
+    files instead of memory (see spill)
+    """
+    def __init__(self, folder = None):
+        """
+        Constructor
+        """
+        self.n_tracks = 0
+        self._frame_ids = []
+        self._frame_tracks = []
+        self._csr = None
+        self._occupancy = None
+        # frames written in the raw files of the folder, not mapped yet
+        # if their entry in _frame_ids and _frame_tracks is None
+        self._folder = None
+        self._raw_frames = []
+        self._raw_offsets = [0]
+        if folder is not None:
+            self.spill(folder)
+
+    @classmethod
+    def fromFrames(cls, frame_ids, frame_tracks):
+        """
+        Build the store from the IDs and the track index (see 
+        trackFrames) of the points of each frame
+        """
+        store = cls()
+        for ids, tracks in zip(frame_ids, frame_tracks):
+            store.appendFrame(ids, tracks)
+
+        return store
+
+    def appendFrame(self, ids, tracks, n_tracks = None):
+        """
+        Add the IDs and track indexes of the points of a new frame.
+        With a folder, they are written to its files
+        """
+        ids = np.asarray(ids, dtype = np.int32)
+        tracks = np.asarray(tracks, dtype = np.int32)
+        if n_tracks is None:
+            n_tracks = max(self.n_tracks, int(tracks.max())+1 if tracks.shape[0] else 0)
+        if self._folder is None:
+            self._frame_ids.append(ids)
+            self._frame_tracks.append(tracks)
+        else:
+            self._writeFrame(self.n_frames, ids, tracks)
+            self._frame_ids.append(None)
+            self._frame_tracks.append(None)
+        self.n_tracks = n_tracks
+        self._csr = None
+        self._occupancy = None
+
+    def _writeFrame(self, frame, ids, tracks):
+        """
+        Append a frame to the raw files of the folder
+        """
+        with open(join(self._folder, 'frame_ids.bin'), 'ab') as f:
+            f.write(np.asarray(ids, dtype = np.int32).tobytes())
+        with open(join(self._folder, 'frame_tracks.bin'), 'ab') as f:
+            f.write(np.asarray(tracks, dtype = np.int32).tobytes())
+        self._raw_frames.append(frame)
+        self._raw_offsets.append(self._raw_offsets[-1] + tracks.shape[0])
+
+    def _mapFrames(self):
+        """
+        Map the frames written to the raw files since the last call
+        """
+        if not self._raw_frames or self._frame_tracks[self._raw_frames[-1]] is not None:
+            return
+        n_points = self._raw_offsets[-1]
+        ids = _openRaw(join(self._folder, 'frame_ids.bin'), np.int32, (n_points,))
+        tracks = _openRaw(join(self._folder, 'frame_tracks.bin'), np.int32, (n_points,))
+        for frame, ini, end in zip(self._raw_frames, self._raw_offsets[:-1], self._raw_offsets[1:]):
+            self._frame_ids[frame] = ids[ini:end]
+            self._frame_tracks[frame] = tracks[ini:end]
+
+    @property
+    def n_frames(self):
+        return len(self._frame_tracks)
+
+    def frameTracks(self, frame):
+        """
+        Track index of each row of the frame (-1 if lost)
+        """
+        self._mapFrames()
+        return self._frame_tracks[frame]
+
+    def frameIDs(self, frame):
+        """
+        XML ID of each row of the frame
+        """
+        self._mapFrames()
+        return self._frame_ids[frame]
+
+    def _build(self):
+        """
+        Group the points by track, with a counting pass over the frames:
+        the points of each frame are put after the previous points of
+        their tracks, so only a frame is in memory at a time
+        """
+        self._mapFrames()
+        counts = np.zeros(self.n_tracks, dtype = np.int64)
+        for tracks in self._frame_tracks:
+            # a track has at most one point per frame
+            counts[tracks[tracks >= 0]] += 1
+        offsets = np.zeros(self.n_tracks+1, dtype = np.int64)
+        offsets[1:] = np.cumsum(counts)
+
+        n_points = int(offsets[-1])
+        csr = _emptyArrays(self._folder, {name: ((n_points,), np.int32) 
+            for name in ['csr_frame', 'csr_ID', 'csr_row']})
+        next_point = offsets[:-1].copy()
+        for frame, (ids, tracks) in enumerate(zip(self._frame_ids, self._frame_tracks)):
+            rows = np.flatnonzero(np.asarray(tracks) >= 0)
+            tracked = tracks[rows]
+            points = next_point[tracked]
+            csr['csr_frame'][points] = frame
+            csr['csr_ID'][points] = ids[rows]
+            csr['csr_row'][points] = rows
+            next_point[tracked] += 1
+        csr = _closeArrays(self._folder, csr)
+
+        self._csr = {'offsets': offsets, 'frame': csr['csr_frame'], 'ID': csr['csr_ID'], 
+            'row': csr['csr_row'], 't_appearance': np.asarray(csr['csr_frame'][offsets[:-1]])}
+
+    def _get(self, name):
+        if self._csr is None:
+            self._build()
+        return self._csr[name]
+
+    offsets = property(lambda self: self._get('offsets'))
+    frame = property(lambda self: self._get('frame'))
+    ID = property(lambda self: self._get('ID'))
+    row = property(lambda self: self._get('row'))
+    t_appearance = property(lambda self: self._get('t_appearance'))
+
+    def occupancy(self):
+        """
+        Sparse (CSR) frame x track occupancy matrix: the tracks alive in
+        frame t are tracks[offsets[t]:offsets[t+1]], in increasing order,
+        with the XML ID and the row of their point in the frame. It is
+        built once, a frame at a time, and again only after new frames
+        are added.
+
+        OUTPUT
+
+        dictionary with offsets, tracks, ID and row
+        """
+        if self._occupancy is None:
+            self._mapFrames()
+            offsets = np.zeros(self.n_frames+1, dtype = np.int64)
+            offsets[1:] = np.cumsum([np.count_nonzero(np.asarray(tracks) >= 0) 
+                for tracks in self._frame_tracks])
+
+            n_points = int(offsets[-1])
+            occupancy = _emptyArrays(self._folder, {name: ((n_points,), np.int32) 
+                for name in ['occupancy_tracks', 'occupancy_ID', 'occupancy_row']})
+            for frame, (ids, tracks) in enumerate(zip(self._frame_ids, self._frame_tracks)):
+                rows = np.flatnonzero(np.asarray(tracks) >= 0)
+                # sort by track
+                rows = rows[np.argsort(tracks[rows], kind = 'mergesort')]
+                ini, end = offsets[frame:frame+2]
+                occupancy['occupancy_tracks'][ini:end] = tracks[rows]
+                occupancy['occupancy_ID'][ini:end] = ids[rows]
+                occupancy['occupancy_row'][ini:end] = rows
+            occupancy = _closeArrays(self._folder, occupancy)
+
+            self._occupancy = {'offsets': offsets, 'tracks': occupancy['occupancy_tracks'], 
+                'ID': occupancy['occupancy_ID'], 'row': occupancy['occupancy_row']}
+
+        return self._occupancy
+
+    def tracksInFrame(self, frame):
+        """
+        Tracks alive in the frame, in increasing order
+        """
+        occupancy = self.occupancy()
+        ini, end = occupancy['offsets'][frame:frame+2]
+        return occupancy['tracks'][ini:end]
+
+    def lengths(self):
+        """
+        Number of frames of each track
+        """
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return self.n_tracks
+
+    def __iter__(self):
+        for track in range(self.n_tracks):
+            yield self[track]
+
+    def __getitem__(self, track):
+        """
+        Sequence of IDs of the track
+        """
+        offsets = self.offsets
+        return self.ID[offsets[track]:offsets[track+1]]
+
+    def track2ID(self, track, frame):
+        """
+        ID of the point of the track in the frame (None if the
+        track does not exist in this frame)
+        """
+        t_ini = self.t_appearance[track]
+        index = self.offsets[track] + frame - t_ini
+        if frame >= t_ini and index < self.offsets[track+1]:
+            return int(self.ID[index])
+
+        return None
+
+    def row2Track(self, frame, row):
+        """
+        Track of the point in the row of the frame (None if lost)
+        """
+        track = int(self.frameTracks(frame)[row])
+        return track if track >= 0 else None
+
+    def toArrays(self):
+        """
+        Dictionary with all the arrays of the store, that can be 
+        saved with np.save/np.savez (see fromArrays). For a store in
+        a folder (see spill), the points of the frames are joined in
+        memory-mapped files of the folder instead of memory
+        """
+        self._mapFrames()
+        out = {'n_tracks': np.asarray(self.n_tracks)}
+        out['frame_offsets'] = np.concatenate(([0], np.cumsum(
+            [tracks.shape[0] for tracks in self._frame_tracks]))).astype(np.int64)
+        n_points = int(out['frame_offsets'][-1])
+        frames = _emptyArrays(self._folder, {name: ((n_points,), np.int32) 
+            for name in ['frame_tracks', 'frame_ids']})
+        for frame, (ids, tracks) in enumerate(zip(self._frame_ids, self._frame_tracks)):
+            ini, end = out['frame_offsets'][frame:frame+2]
+            frames['frame_tracks'][ini:end] = tracks
+            frames['frame_ids'][ini:end] = ids
+        out.update(_closeArrays(self._folder, frames))
+        for name in ['offsets', 'frame', 'ID', 'row', 't_appearance']:
+            out['track_' + name] = self._get(name)
+
+        return out
+
+    @classmethod
+    def fromArrays(cls, arrays):
+        """
+        Build the store from the output of toArrays
+        """
+        store = cls()
+        store.n_tracks = int(arrays['n_tracks'])
+        offsets = arrays['frame_offsets'].tolist()
+        store._frame_tracks = [arrays['frame_tracks'][a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+        store._frame_ids = [arrays['frame_ids'][a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+        store._csr = {name: arrays['track_' + name] 
+            for name in ['offsets', 'frame', 'ID', 'row', 't_appearance']}
+
+        return store
+
+    def spill(self, folder):
+        """
+        Keep the arrays of the store in memory-mapped files of folder.
+        The frames in memory are moved to the files, and the frames
+        added after are written there directly, so the store works 
+        the same way reading the arrays from disk when needed. The
+        track (CSR) and occupancy arrays are built into the folder
+        a frame at a time. Arrays already memory-mapped (e.g. loaded 
+        from the cache of TrackingAnalysis) are not copied
+        """
+        if folder == self._folder:
+            return
+        self._mapFrames()
+        ensure_dir(join(folder, ''))
+        for name in ['frame_ids.bin', 'frame_tracks.bin']:
+            if os.path.isfile(join(folder, name)):
+                os.remove(join(folder, name))
+        self._folder = folder
+        self._raw_frames = []
+        self._raw_offsets = [0]
+        for frame in range(self.n_frames):
+            if not _isMapped(self._frame_tracks[frame]):
+                self._writeFrame(frame, self._frame_ids[frame], self._frame_tracks[frame])
+                self._frame_ids[frame] = None
+                self._frame_tracks[frame] = None
+
+        # built again in the folder when needed
+        if self._csr is not None and not _isMapped(self._csr['ID']):
+            self._csr = None
+        if self._occupancy is not None and not _isMapped(self._occupancy['ID']):
+            self._occupancy = None
+
+    def save(self, path):
+        """
+        Save the store in a npz file
+        """
+        np.savez(path, **self.toArrays())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a store saved with save
+        """
+        with np.load(path) as data:
+            return cls.fromArrays({name: data[name] for name in data.files})
+
+class LineageIndex(object):
+    """
+    Lineage tree of the tracks, with the track that divided into each
+    track (parent, -1 for the roots) and the children of track i in 
+    children[child_offsets[i]:child_offsets[i+1]]. The tree is also
+    numbered in an Euler tour (depth first, children in increasing
+    order): the descendants of track i are the tracks with
+    tin[i] < tin[j] < tout[i], so they are listed in 
+    euler[tin[i]+1:tout[i]]. A child track always has a bigger index
+    than its parent, since it appears later.
+    """
+    def __init__(self, parent):
+        """
+        Constructor
+        """
+        parent = np.asarray(parent, dtype = np.int64)
+        n_tracks = parent.shape[0]
+        self.parent = parent
+
+        # children grouped by parent, in increasing order
+        has_parent = np.flatnonzero(parent >= 0)
+        self.children = has_parent[np.argsort(parent[has_parent], kind = 'mergesort')]
+        self.child_offsets = np.zeros(n_tracks+1, dtype = np.int64)
+        self.child_offsets[1:] = np.cumsum(np.bincount(parent[has_parent], minlength = n_tracks))
+
+        # depth and root, one generation at a time
+        self.depth = np.zeros(n_tracks, dtype = np.int64)
+        self.root = np.arange(n_tracks, dtype = np.int64)
+        levels = [np.flatnonzero(parent < 0)]
+        while levels[-1].shape[0] > 0:
+            level = self.children[np.concatenate([np.arange(a, b) for a, b in zip(
+                self.child_offsets[levels[-1]], self.child_offsets[levels[-1]+1])] + 
+                [np.zeros(0, np.int64)])]
+            self.depth[level] = len(levels)
+            self.root[level] = self.root[parent[level]]
+            levels.append(level)
+
+        # subtree sizes, from the leaves up
+        self.size = np.ones(n_tracks, dtype = np.int64)
+        for level in levels[:0:-1]:
+            np.add.at(self.size, parent[level], self.size[level])
+
+        # Euler tour: each track starts after its parent and the 
+        # subtrees of its previous siblings
+        self.tin = np.zeros(n_tracks, dtype = np.int64)
+        roots = levels[0]
+        self.tin[roots] = np.cumsum(self.size[roots]) - self.size[roots]
+        before = np.concatenate(([0], np.cumsum(self.size[self.children])))
+        position = np.zeros(n_tracks, dtype = np.int64)
+        position[self.children] = np.arange(self.children.shape[0])
+        for level in levels[1:]:
+            first = self.child_offsets[parent[level]]
+            self.tin[level] = self.tin[parent[level]] + 1 + before[position[level]] - before[first]
+        self.tout = self.tin + self.size
+        self.euler = np.argsort(self.tin)
+
+    def __len__(self):
+        return self.parent.shape[0]
+
+    def childrenOf(self, track):
+        """
+        Tracks created by the divisions of the track
+        """
+        return self.children[self.child_offsets[track]:self.child_offsets[track+1]]
+
+    def ancestors(self, track):
+        """
+        Ancestors of the track, from the parent to the root
+        """
+        out = []
+        track = self.parent[track]
+        while track >= 0:
+            out.append(int(track))
+            track = self.parent[track]
+
+        return out
+
+    def descendants(self, track):
+        """
+        All the tracks descending from the track, in Euler order
+        """
+        return self.euler[self.tin[track]+1:self.tout[track]]
+
+    def isDescendant(self, track, ancestor):
+        """
+        If track (or array of tracks) descends from ancestor
+        """
+        tin = self.tin[track]
+        return (self.tin[ancestor] < tin) & (tin < self.tout[ancestor])
+
+    def cloneMask(self, tracks):
+        """
+        Boolean mask of the tracks that are one of the tracks
+        or descend from them
+        """
+        tracks = np.asarray(tracks, dtype = np.int64)
+        n_tracks = len(self)
+
+        # mark the intervals of the Euler tour that are covered
+        coverage = np.bincount(self.tin[tracks], minlength = n_tracks+1) - \
+            np.bincount(self.tout[tracks], minlength = n_tracks+1)
+        mask = np.zeros(n_tracks, dtype = bool)
+        mask[self.euler] = np.cumsum(coverage[:-1]) > 0
+
+        return mask
+
+def readHDF5Frames(path, frame_ini = 0, frame_end = None):
+    """
+    Read the frames frame_ini to frame_end (included, None is the
+    last one) of a run exported with TrackingAnalysis.export. Only
+    the chunks of these frames are read from the file
+    ---
+    PARAMETERS
+
+    path: HDF5 file
+    frame_ini, frame_end: first and last frames (index in the run)
+
+    OUTPUT
+
+    list of FrameTables, or None if h5py is not installed
+    """
+    if h5py is None:
+        print("WARNING! h5py is not installed, the HDF5 file cannot be read.")
+        return None
+
+    with h5py.File(path, 'r') as f:
+        frames = f['frames']
+        frame_offsets = frames['frame_offsets'][:]
+        if frame_end is None:
+            frame_end = frame_offsets.shape[0] - 2
+        ini, end = frame_offsets[[frame_ini, frame_end+1]]
+        sv_offsets = frames['sv_offsets'][ini:end+1]
+        packed = {'frame_offsets': frame_offsets[frame_ini:frame_end+2] - ini,
+            'xyz': frames['xyz'][:, ini:end], 'ID': frames['ID'][ini:end], 
+            'parent': frames['parent'][ini:end], 'sv_offsets': sv_offsets - sv_offsets[0],
+            'sv_values': frames['sv_values'][sv_offsets[0]:sv_offsets[-1]]}
+
+    return [_unpackFrame(packed, t) for t in range(frame_end - frame_ini + 1)]
 
 def readLogAmat(path):
     """
@@ -165,86 +1372,393 @@ def readSuperVoxelFromFile(filename, imageDim = 3):
     """
     Reads the supervoxels binary files generated by the tracking software 
     described by Amat et al., Nature methods, 11, 2014.
+    The file is read in one call and the pixel list of each 
+    supervoxel is a uint64 view of the file data (read only).
     """
     # Similar to functions the authors built in Matlab
-    fid = open(filename, 'rb')
-    numSv, = struct.unpack('i', fid.read(4))
-    TM = np.zeros(numSv)
-    dataSizeInBytes = np.zeros(numSv)
+    with open(filename, 'rb') as fid:
+        data = fid.read()
+
+    numSv, = struct.unpack_from('i', data, 0)
     dataDims = np.zeros((imageDim, numSv))
-    pixIDlist = [np.zeros(1),]*numSv
+    pixIDlist = [None,]*numSv
+
+    # each header is TM (int32), dataSizeInBytes (uint64), the 
+    # dimensions (uint64) and the number of pixels (uint32)
+    header = struct.Struct('=iQ' + 'Q'*imageDim + 'I')
+    offset = 4
     for k in range(numSv):
-        TM[k], = struct.unpack('i', fid.read(4))
-        dataSizeInBytes[k], = struct.unpack('Q', fid.read(8))
-        dataDims[:,k] = np.asarray(struct.unpack('Q'*imageDim, fid.read(8*imageDim)))
-        ll, = struct.unpack('I', fid.read(4))
-        if ll>0:
-            pixIDlist[k] = np.asarray(struct.unpack('Q'*ll, fid.read(8*ll)))
-        else:
-            pixIDlist[k] = np.asarray([])
+        values = header.unpack_from(data, offset)
+        dataDims[:,k] = values[2:2+imageDim]
+        ll = values[-1]
+        offset += header.size
+        pixIDlist[k] = np.frombuffer(data, dtype = np.uint64, count = ll, offset = offset)
+        offset += 8*ll
 
     return dataDims, pixIDlist
 
+class SuperVoxelMap(object):
+    """
+    List-like access to the pixel lists of a supervoxel binary file
+    (see readSuperVoxelFromFile) through a memory map. Supervoxel k
+    is a read only uint64 view of the mapped file, so only the pages
+    of the supervoxels used are read.
+    ---
+    PARAMETERS
+
+    filename: supervoxel binary file (.svb)
+    imageDim: dimension of the image
+    index_path (optional): npz file where the position of each pixel
+    list is kept, so that the headers are only walked again if the
+    file changes. If None, the index is not saved
+    """
+    def __init__(self, filename, imageDim = 3, index_path = None):
+        """
+        Constructor
+        """
+        self.filename = filename
+        self._data = np.memmap(filename, dtype = np.uint8, mode = 'r')
+
+        index = None
+        if index_path is not None:
+            index = _loadNpz(index_path)
+        if index is None or index['key'].tolist() != fileKey(filename):
+            index = self._buildIndex(imageDim)
+            index['key'] = np.asarray(fileKey(filename), dtype = np.int64)
+            if index_path is not None:
+                _saveNpz(index_path, index)
+
+        self.dims = index['dims']
+        self.offsets = index['offsets']
+        self.counts = index['counts']
+
+    def _buildIndex(self, imageDim):
+        """
+        Walk the headers of the file, with the dimensions, the byte
+        offset and the number of pixels of each supervoxel
+        """
+        numSv, = struct.unpack_from('i', self._data, 0)
+        dims = np.zeros((imageDim, numSv))
+        offsets = np.zeros(numSv, dtype = np.int64)
+        counts = np.zeros(numSv, dtype = np.int64)
+
+        # same header as in readSuperVoxelFromFile
+        header = struct.Struct('=iQ' + 'Q'*imageDim + 'I')
+        offset = 4
+        for k in range(numSv):
+            values = header.unpack_from(self._data, offset)
+            dims[:,k] = values[2:2+imageDim]
+            offsets[k] = offset + header.size
+            counts[k] = values[-1]
+            offset = offsets[k] + 8*counts[k]
+
+        return {'dims': dims, 'offsets': offsets, 'counts': counts}
+
+    def __len__(self):
+        return self.offsets.shape[0]
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self)
+        ini = self.offsets[k]
+        return self._data[ini:ini + 8*self.counts[k]].view(np.uint64)
+
+def decodePixelsAddress(pixIDList, dimX, dimY, svIDs = None, return_offsets = False):
+    """
+    Calculate the pixels addresses (x, y, z) of the supervoxels. The
+    pixel lists of the supervoxels are joined in a single array and 
+    decoded at once
+    ---
+    PARAMETERS
+
+    pixIDList: pixel lists of the supervoxels (see readSuperVoxelFromFile)
+    dimX, dimY: dimensions of the image
+    svIDs: supervoxels to decode (None is all)
+    return_offsets: if to return the offsets of the supervoxels
+
+    OUTPUT
+
+    pixPoints: array (n_pixels, 3) with x, y, z of the pixels, with the
+    smallest unsigned integer type that fits the image
+    offsets (if return_offsets): the pixels of supervoxel svIDs[k] are 
+    pixPoints[offsets[k]:offsets[k+1]]
+    """
+    if svIDs is None:
+        svIDs = range(len(pixIDList))
+    lists = [pixIDList[svID] for svID in svIDs]
+
+    offsets = np.zeros(len(lists)+1, dtype = np.int64)
+    offsets[1:] = np.cumsum([pixIDs.shape[0] for pixIDs in lists])
+    pixIDs = np.concatenate([np.zeros(0, np.int64)] + 
+        [np.asarray(pixIDs, dtype = np.int64) for pixIDs in lists])
+
+    dimX = int(dimX)
+    dimY = int(dimY)
+    dimZ = int(pixIDs.max()) // (dimX*dimY) + 1 if pixIDs.shape[0] else 1
+    dtype = np.min_scalar_type(max(dimX, dimY, dimZ))
+
+    pixPoints = np.empty((pixIDs.shape[0], 3), dtype = dtype)
+    z, y, x = np.unravel_index(pixIDs, (dimZ, dimY, dimX))
+    pixPoints[:,0] = x
+    pixPoints[:,1] = y
+    pixPoints[:,2] = z
+
+    if return_offsets:
+        return pixPoints, offsets
+    return pixPoints
+
 def calcPixelsAddress(svIDList, pixIDList, dimX, dimY):
     """
-    Calculate the pixels addresses of the supervoxels
-    This is only done for the supervoxels in svIdList
+    Calculate the pixels addresses of the supervoxels
+    This is only done for the supervoxels in svIdList
+    """
+    svIDs = [svID for svIDs in svIDList for svID in svIDs]
+    if len(svIDs) == 0:
+        return None
+
+    return decodePixelsAddress(pixIDList, dimX, dimY, svIDs)
+
+def calcAllPixelsAddress(pixIDList, dimX, dimY):
+    """
+    Calculate the pixels addresses of all the supervoxels
+    """
+    return decodePixelsAddress(pixIDList, dimX, dimY)
+
+def labelSuperVoxels(pixIDList, shape):
+    """
+    Label volume of the supervoxels: each voxel of the image has the
+    index+1 of its supervoxel (0 is no supervoxel). The pixel indexes
+    of the binary file are the flat indexes of the image, so no
+    coordinates are calculated
+    ---
+    PARAMETERS
+
+    pixIDList: pixel lists of the supervoxels (see readSuperVoxelFromFile)
+    shape: shape (z, y, x) of the image
+
+    OUTPUT
+
+    uint32 array with the shape of the image
+    """
+    counts = [pixIDs.shape[0] for pixIDs in pixIDList]
+    pixIDs = np.concatenate([np.zeros(0, np.int64)] + 
+        [np.asarray(pixIDs, dtype = np.int64) for pixIDs in pixIDList])
+
+    labels = np.zeros(int(np.prod(shape)), dtype = np.uint32)
+    labels[pixIDs] = np.repeat(np.arange(1, len(counts)+1, dtype = np.uint32), counts)
+
+    return labels.reshape(shape)
+
+class PixelSlices(object):
+    """
+    Pixels (see decodePixelsAddress) sorted by z once, with the offset
+    of each slice, so that the pixels of slice z are a view
+    slices[z] of shape (n, 3), without going through all the pixels
+    ---
+    PARAMETERS
+
+    pixPoints: array (n_pixels, 3) with x, y, z (None is no pixels)
+    n_slices: number of slices (None is up to the last z with pixels)
+    """
+    def __init__(self, pixPoints, n_slices = None):
+        """
+        Constructor
+        """
+        if pixPoints is None:
+            pixPoints = np.zeros((0, 3), dtype = np.uint8)
+        z = pixPoints[:,2].astype(np.int64)
+        if n_slices is None:
+            n_slices = int(z.max()) + 1 if z.shape[0] else 0
+
+        order = np.argsort(z, kind = 'mergesort')
+        self.pixPoints = pixPoints[order]
+        self.offsets = np.zeros(n_slices+1, dtype = np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(z, minlength = n_slices)[:n_slices])
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, z):
+        if z < 0 or z >= len(self):
+            return self.pixPoints[0:0]
+        return self.pixPoints[self.offsets[z]:self.offsets[z+1]]
+
+def _hashable(value):
+    """
+    Lists and arrays as tuples, so that they can be part of a key
     """
-    ini = True
-    for svIDs in svIDList:
-        for svID in svIDs:
-            pixIDs = pixIDList[svID]
-            pixs = np.zeros((pixIDs.shape[0], 3))
-            szFrame = dimX*dimY
-            pixs[:,2] = pixIDs // szFrame
-            pixs[:,1] = (pixIDs % szFrame) // dimX
-            pixs[:,0] = (pixIDs % szFrame) % dimX
-
-            if ini:
-                pixPoints = pixs
-                ini = False
-            else:
-                pixPoints = np.vstack((pixPoints, pixs))
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(np.asarray(value).ravel().tolist())
+    return value
 
-    if ini:
-        return None
-    else:
-        return pixPoints
-
-def calcAllPixelsAddress(pixIDList, dimX, dimY):
+class TrackFilter(object):
     """
-    Calculate the pixels addresses of all the supervoxels
+    Condition on the tracks of a TrackingAnalysis, evaluated as a
+    boolean mask over the tracks (see TrackingAnalysis.filterMask).
+    The conditions are built with the class methods (length, 
+    timeWindow, boundingBox, meanSpeed and lineage) and combined
+    with &, | and ~, e.g.
+
+        TrackFilter.length(10) & ~TrackFilter.lineage([3, 7])
+
+    The signature identifies the condition, and the masks are kept
+    by TrackingAnalysis for each signature. Only boundingBox and
+    meanSpeed need the positions of the points, the other conditions
+    use the TrackStore alone.
     """
-    ini = True
-    for pixIDs in pixIDList:
-        pixs = np.zeros((pixIDs.shape[0], 3))
-        szFrame = dimX*dimY
-        pixs[:,2] = pixIDs // szFrame
-        pixs[:,1] = (pixIDs % szFrame) // dimX
-        pixs[:,0] = (pixIDs % szFrame) % dimX
-
-        if ini:
-            pixPoints = pixs
-            ini = False
-        else:
-            pixPoints = np.vstack((pixPoints, pixs))
+    def __init__(self, kind, *args):
+        """
+        Constructor
+        """
+        self.kind = kind
+        self.args = tuple(arg if isinstance(arg, TrackFilter) else _hashable(arg) for arg in args)
 
-    return pixPoints
+    @property
+    def signature(self):
+        return (self.kind,) + tuple(arg.signature if isinstance(arg, TrackFilter) else arg 
+            for arg in self.args)
+
+    def __repr__(self):
+        return 'TrackFilter%s'%repr(self.signature)
+
+    def __and__(self, other):
+        return TrackFilter('And', self, other)
+
+    def __or__(self, other):
+        return TrackFilter('Or', self, other)
+
+    def __invert__(self):
+        return TrackFilter('Not', self)
+
+    @classmethod
+    def length(cls, min_frames, max_frames = None):
+        """
+        Tracks lasting at least min_frames (and at most max_frames)
+        """
+        return cls('Length', min_frames, max_frames)
+
+    @classmethod
+    def timeWindow(cls, frame_ini, frame_end, whole = False):
+        """
+        Tracks alive at some frame between frame_ini and frame_end, 
+        or only during these frames if whole is True
+        """
+        return cls('TimeWindow', frame_ini, frame_end, whole)
+
+    @classmethod
+    def boundingBox(cls, xyz_min, xyz_max, whole = True):
+        """
+        Tracks with all the points inside the box [xyz_min, xyz_max]
+        (XML coordinates), or with any point if whole is False
+        """
+        return cls('BoundingBox', xyz_min, xyz_max, whole)
+
+    @classmethod
+    def meanSpeed(cls, min_speed, max_speed = None):
+        """
+        Tracks with mean speed (pixels per frame, with z scaled by
+        the anisotropy) between min_speed and max_speed
+        """
+        return cls('MeanSpeed', min_speed, max_speed)
+
+    @classmethod
+    def lineage(cls, tracks):
+        """
+        Tracks that are one of the tracks or descend from them
+        """
+        return cls('Lineage', tracks)
+
+    def evaluate(self, analysis):
+        """
+        Boolean mask over the tracks of the analysis
+        """
+        return getattr(self, '_mask' + self.kind)(analysis, *self.args)
+
+    @staticmethod
+    def _maskAnd(analysis, first, second):
+        return analysis.filterMask(first) & analysis.filterMask(second)
+
+    @staticmethod
+    def _maskOr(analysis, first, second):
+        return analysis.filterMask(first) | analysis.filterMask(second)
+
+    @staticmethod
+    def _maskNot(analysis, first):
+        return ~analysis.filterMask(first)
+
+    @staticmethod
+    def _maskLength(analysis, min_frames, max_frames):
+        length = analysis.tracks.lengths()
+        mask = length >= min_frames
+        if max_frames is not None:
+            mask &= length <= max_frames
+        return mask
+
+    @staticmethod
+    def _maskTimeWindow(analysis, frame_ini, frame_end, whole):
+        start_frame = analysis.tracks.t_appearance
+        end_frame = start_frame + analysis.tracks.lengths() - 1
+        if whole:
+            return (start_frame >= frame_ini) & (end_frame <= frame_end)
+        return (start_frame <= frame_end) & (end_frame >= frame_ini)
+
+    @staticmethod
+    def _maskBoundingBox(analysis, xyz_min, xyz_max, whole):
+        xyz, track = analysis._trackPoints()
+        inside = np.all((xyz >= np.reshape(xyz_min, (3,1))) & 
+            (xyz <= np.reshape(xyz_max, (3,1))), axis = 0)
+        n_inside = np.bincount(track[inside], minlength = len(analysis.tracks))
+        if whole:
+            return n_inside == analysis.tracks.lengths()
+        return n_inside > 0
+
+    @staticmethod
+    def _maskMeanSpeed(analysis, min_speed, max_speed):
+        speed = analysis.trackFeatures()['mean_speed']
+        mask = speed >= min_speed
+        if max_speed is not None:
+            mask &= speed <= max_speed
+        return mask
+
+    @staticmethod
+    def _maskLineage(analysis, tracks):
+        return analysis.lineageIndex().cloneMask(tracks)
 
 class TrackingAnalysis(object):
     """
     This class reads the results from the tracking software and
     offer a myriad of functions to extract the data and filter
-    the points.
+    the points. In a run still going, only the frames already 
+    written are read, and the next ones are added with appendFrames.
     ---
     PARAMETERS
 
     folder: folder with the results to analyse
     background_detector (optional): boolean if to use the detector
+    workers (optional): number of processes used to read the XMLs
+    use_cache (optional): if to keep the parsed XMLs and the tracks
+    in binary files inside the folder (see CACHE_FOLDER)
+    lazy_frames (optional): if True, the frames are only read when
+    accessed (see LazyFrames). With use_cache, the frames are 
+    memory-mapped from the cache (see readXMLAmatFrameCached)
+    frames_memory (optional): memory budget in bytes of the frames
+    kept in memory when lazy_frames is True (None is unlimited)
+    scratch_dir (optional): folder for the out-of-core mode. The tracks
+    are written to memory-mapped files in it a frame at a time, also
+    for the frames added later by appendFrames, and the frames are read
+    lazily (lazy_frames is implied) and memory-mapped from the cache of
+    the frames, or from files in scratch_dir if use_cache is False, so
+    that only frames_memory, the values per track and the pages in use
+    are resident
     """
     # Filter constants
     MIN_FRAMES_KEY = 'MIN_FRAMES'
     BLACK_LIST_KEY = 'BLACK_LIST'
+    EXPRESSION_KEY = 'EXPRESSION'
 
     # Amat log file constants
     IMAGE_PATH_KEY = 'IMAGE_PATH'
@@ -255,7 +1769,14 @@ class TrackingAnalysis(object):
     XML_PATH_KEY = 'XML_PATH'
     BINATY_PATH_KEY = 'BINATY_PATH'
 
-    def __init__(self, folder, background_detector = True):
+    # Folder (inside the results folder) with the binary cache
+    CACHE_FOLDER = 'analysis_cache'
+
+    # Maximum number of points of the tracks in memory in trackFeatures
+    FEATURES_CHUNK = 2**20
+
+    def __init__(self, folder, background_detector = True, workers = 1, use_cache = True,
+            lazy_frames = False, frames_memory = 2**30, scratch_dir = None):
         """
         Constructor
         """
@@ -275,17 +1796,257 @@ class TrackingAnalysis(object):
         self.configs[self.BINATY_PATH_KEY] = join(join(self.folder,'XML_finalResult_lht'),'GMEMfinalResult_frame????.svb')
         time_ini = self.configs[self.TIME_INI_KEY]
         time_end = self.configs[self.TIME_END_KEY]
-        self.n_frames = time_end - time_ini + 1
-        self.pos = readXMLAmat(xml_path, time_ini, time_end, symbol = '?')
+
+        # the log has the planned last frame, a run still going only has
+        # the frames written so far (the next ones are read by appendFrames)
+        self.n_frames = completeXMLAmatFrames(xml_path, time_ini, time_end, symbol = '?')
+        if self.n_frames < time_end - time_ini + 1:
+            print("WARNING! Only %d of the %d frames of the run are complete, "
+                "the next ones can be added with appendFrames."%(self.n_frames, time_end - time_ini + 1))
+            time_end = time_ini + self.n_frames - 1
+            self.configs[self.TIME_END_KEY] = time_end
+
+        # Binary cache of the parsed results, one per XML folder
+        cache_name = os.path.basename(os.path.dirname(xml_path))
+        if use_cache:
+            self._frames_cache_path = join(self.folder, self.CACHE_FOLDER, cache_name + '_frames')
+            self._tracks_cache_path = join(self.folder, self.CACHE_FOLDER, cache_name + '_tracks')
+        else:
+            self._frames_cache_path = None
+            self._tracks_cache_path = None
+
+        # Out-of-core mode, with the arrays in memory-mapped files
+        self._scratch_dir = None
+        if scratch_dir is not None:
+            self._scratch_dir = join(scratch_dir, os.path.basename(os.path.abspath(self.folder)), cache_name)
+
+        if self._scratch_dir is not None or lazy_frames:
+            paths = xmlAmatPaths(xml_path, time_ini, time_end, symbol = '?')
+            # with a cache folder, each frame is memory-mapped from its file
+            # when accessed, and only the frames whose XML changed are parsed
+            cache_folder = self._frames_cache_path
+            if cache_folder is None and self._scratch_dir is not None:
+                cache_folder = join(self._scratch_dir, 'frames')
+            self.pos = LazyFrames(paths, frames_memory, cache_folder = cache_folder)
+        else:
+            self.pos = readXMLAmat(xml_path, time_ini, time_end, symbol = '?', 
+                workers = workers, cache_path = self._frames_cache_path)
 
         self.manual_tracks = readManualTrackFile(mtrack_filename)
+        self._initVariables()
+
+        # track the cells
+        if not self._loadTracksCache():
+            self.trackCells()
+            self._saveTracksCache()
+        if self._scratch_dir is not None:
+            self.tracks.spill(join(self._scratch_dir, 'tracks'))
 
-        # variable empty initialization
-        self.index_filter = []
+    def _initVariables(self):
+        """
+        Variable empty initialization
+        """
+        self._filter_mask = np.zeros(0, dtype = bool)
         self._filter_config = {}
+        self._com_cache = {}
+        self._kdtrees = {}
+        self._mask_cache = {}
+        self._points_cache = None
+        self._features_cache = {}
+        self._lineage_cache = None
+        self._h5_file = None
+        # points that lost track, [t, ID] (see trackFrames)
+        self._lost = np.zeros((0, 2), dtype = np.int64)
+
+    def _xmlKeys(self):
+        """
+        Size and modification time of all the XMLs of the run
+        """
+        paths = xmlAmatPaths(self.configs[self.XML_PATH_KEY], 
+            self.configs[self.TIME_INI_KEY], self.configs[self.TIME_END_KEY])
 
-        # track the cells
-        self.trackCells()
+        return np.asarray([fileKey(path) for path in paths], dtype = np.int64).reshape(-1, 2)
+
+    def _loadTracksCache(self):
+        """
+        Load the output of trackCells from the cache, if it
+        was generated from the same XMLs. Returns if it was loaded
+        """
+        if self._tracks_cache_path is None:
+            return False
+
+        # the arrays are memory-mapped, and only read when needed
+        cache = _loadNpyFolder(self._tracks_cache_path)
+        if cache is None or not np.array_equal(cache['keys'], self._xmlKeys()):
+            return False
+
+        self._setTracks(TrackStore.fromArrays(cache), cache['division'])
+        self._lost = cache['lost']
+        _printLostTracks(self._lost, self.configs[self.TIME_INI_KEY])
+
+        return True
+
+    def _saveTracksCache(self):
+        """
+        Save the output of trackCells in the cache
+        """
+        if self._tracks_cache_path is None:
+            return False
+
+        out = self.tracks.toArrays()
+        out['keys'] = self._xmlKeys()
+        out['division'] = self._divisionArray()
+        out['lost'] = self._lost
+
+        return _saveNpyFolder(self._tracks_cache_path, out)
+
+    def _divisionArray(self):
+        """
+        Divisions as an array (n, 4) of [t, parent_id, child1_id, child2_id]
+        """
+        return np.asarray([[d['t'], d['parent_id'], d['child1_id'], d['child2_id']]
+            for d in self.division], dtype = np.int64).reshape(-1, 4)
+
+    def _packedFrames(self):
+        """
+        Flat arrays of all the frames (see _packFrames)
+        """
+        packed = getattr(self.pos, '_packed', None)
+        if packed is not None and len(packed['frame_offsets']) == self.n_frames+1:
+            return packed
+
+        return _packFrames([self.pos[t] for t in range(self.n_frames)])
+
+    def export(self, path, compression = 'gzip'):
+        """
+        Write the whole run (configurations, frames, tracks, divisions and
+        manual tracks) to a HDF5 file, that can be loaded with load. The
+        columns of the points are chunked with about one frame per chunk,
+        so that a range of frames is read without reading the whole 
+        file (see readHDF5Frames)
+        ---
+        PARAMETERS
+
+        path: HDF5 file
+        compression: compression filter of h5py (None for no compression)
+
+        OUTPUT
+
+        True if the file was written
+        """
+        if h5py is None:
+            print("WARNING! h5py is not installed, the run was not exported.")
+            return False
+
+        packed = self._packedFrames()
+        frame_offsets = np.asarray(packed['frame_offsets'])
+        n_points = np.diff(frame_offsets)
+        sv_offsets = np.asarray(packed['sv_offsets'])
+        n_sv = np.diff(sv_offsets[frame_offsets])
+        # chunks of the size of a typical frame
+        chunk_points = max(int(np.median(n_points)) if n_points.shape[0] else 1, 1)
+        chunk_sv = max(int(np.median(n_sv)) if n_sv.shape[0] else 1, 1)
+
+        def write(group, name, data, chunk = None):
+            data = np.asarray(data)
+            if chunk is None or data.size == 0:
+                group.create_dataset(name, data = data)
+            else:
+                chunks = data.shape[:-1] + (min(chunk, data.shape[-1]),)
+                group.create_dataset(name, data = data, chunks = chunks, 
+                    compression = compression, shuffle = compression is not None)
+
+        manual = [[id_, time] + point for id_, points in sorted(self.manual_tracks.items()) 
+            for time, point in sorted(points.items())]
+
+        with h5py.File(path, 'w') as f:
+            f.attrs['folder'] = self.folder
+            f.attrs['n_frames'] = self.n_frames
+            for key, value in self.configs.items():
+                f.attrs[key] = value
+
+            frames = f.create_group('frames')
+            write(frames, 'frame_offsets', frame_offsets)
+            write(frames, 'xyz', packed['xyz'], chunk_points)
+            write(frames, 'ID', packed['ID'], chunk_points)
+            write(frames, 'parent', packed['parent'], chunk_points)
+            write(frames, 'sv_offsets', sv_offsets, chunk_points)
+            write(frames, 'sv_values', packed['sv_values'], chunk_sv)
+
+            tracks = f.create_group('tracks')
+            for name, data in self.tracks.toArrays().items():
+                write(tracks, name, data, None if np.ndim(data) == 0 else chunk_points)
+            write(f, 'division', self._divisionArray())
+            write(f, 'manual_tracks', np.asarray(manual, dtype = np.int64).reshape(-1, 5))
+
+        return True
+
+    @classmethod
+    def load(cls, path, lazy_frames = False, frames_memory = 2**30):
+        """
+        Load a run exported with export, without reading the XMLs
+        ---
+        PARAMETERS
+
+        path: HDF5 file
+        lazy_frames (optional): if True, the file is kept open and each
+        frame is only read when accessed (see LazyFrames)
+        frames_memory (optional): memory budget in bytes of the frames
+        kept in memory when lazy_frames is True (None is unlimited)
+
+        OUTPUT
+
+        TrackingAnalysis, or None if h5py is not installed
+        """
+        if h5py is None:
+            print("WARNING! h5py is not installed, the HDF5 file cannot be read.")
+            return None
+
+        self = cls.__new__(cls)
+        self._initVariables()
+        self._frames_cache_path = None
+        self._tracks_cache_path = None
+        self._scratch_dir = None
+
+        f = h5py.File(path, 'r')
+        attrs = {key: value.item() if isinstance(value, np.generic) else value 
+            for key, value in f.attrs.items()}
+        self.folder = attrs.pop('folder')
+        self.n_frames = attrs.pop('n_frames')
+        self.configs = attrs
+
+        frames = f['frames']
+        names = ['frame_offsets', 'xyz', 'ID', 'parent', 'sv_offsets', 'sv_values']
+        time_ini = self.configs[self.TIME_INI_KEY]
+        if lazy_frames:
+            # the datasets are sliced when a frame is accessed
+            paths = xmlAmatPaths(self.configs[self.XML_PATH_KEY], time_ini, 
+                time_ini + self.n_frames - 1, symbol = '?')
+            self.pos = LazyFrames(paths, frames_memory, {name: frames[name] for name in names})
+            self._h5_file = f
+        else:
+            packed = {name: frames[name][...] for name in names}
+            self.pos = [_unpackFrame(packed, t) for t in range(self.n_frames)]
+
+        tracks = TrackStore.fromArrays({name: data[...] for name, data in f['tracks'].items()})
+        self._setTracks(tracks, f['division'][...])
+
+        self.manual_tracks = {}
+        for id_, time, x, y, z in f['manual_tracks'][...].tolist():
+            self.manual_tracks.setdefault(id_, {})[time] = [x, y, z]
+
+        if not lazy_frames:
+            f.close()
+
+        return self
+
+    def close(self):
+        """
+        Close the HDF5 file of a run loaded with lazy_frames (see load)
+        """
+        if self._h5_file is not None:
+            self._h5_file.close()
+            self._h5_file = None
 
     def getLogPath(self, folder):
         """ 
@@ -309,33 +2070,134 @@ class TrackingAnalysis(object):
 
         return readTIFImage(image_path)
 
-    def readSVFile(self, frame, symbol = '?'):
+    def readSVFile(self, frame, symbol = '?', mmap = True):
         """
-        Wrap the functions to read the supervoxel file
+        Wrap the functions to read the supervoxel file. With mmap, 
+        the pixel lists are a SuperVoxelMap and only the supervoxels
+        accessed are read from the file. Its index is kept in the cache
+        folder (see CACHE_FOLDER) when the cache is used
         """
         time_ini = self.configs[self.TIME_INI_KEY] 
         t = time_ini + frame
         binary_path = corrTIFPath(self.configs[self.BINATY_PATH_KEY], symbol, t)
 
+        if mmap:
+            index_path = None
+            if self._frames_cache_path is not None:
+                index_path = join(os.path.dirname(self._frames_cache_path), 'svb_index', 
+                    os.path.splitext(os.path.basename(binary_path))[0] + '.npz')
+            pixIDList = SuperVoxelMap(binary_path, index_path = index_path)
+            return pixIDList.dims, pixIDList
+
         return readSuperVoxelFromFile(binary_path)
 
+    def labelVolume(self, frame, nuclei = False, filtered = False):
+        """
+        Label volume of the frame, with the shape of the input image
+        (z, y, x). Each voxel has the index+1 of its supervoxel, or with
+        nuclei the ID+1 of the nucleus (ID in the XML) that has the
+        supervoxel, and 0 is the background. The supervoxel labels are
+        kept in the cache folder (see CACHE_FOLDER) and memory-mapped 
+        from there (read only) while the binary file does not change
+        ---
+        PARAMETERS
+
+        frame: time frame
+        nuclei: if to label the nuclei instead of the supervoxels
+        filtered: with nuclei, label only the nuclei that meet the 
+        filter conditions
+
+        OUTPUT
+
+        uint32 array (z, y, x)
+        """
+        time_ini = self.configs[self.TIME_INI_KEY] 
+        binary_path = corrTIFPath(self.configs[self.BINATY_PATH_KEY], '?', time_ini + frame)
+
+        labels = None
+        if self._frames_cache_path is not None:
+            labels_path = join(os.path.dirname(self._frames_cache_path), 'labels', 
+                os.path.splitext(os.path.basename(binary_path))[0] + '.npy')
+            key_path = labels_path[:-4] + '_key.npy'
+            if os.path.isfile(key_path) and np.load(key_path).tolist() == fileKey(binary_path):
+                labels = np.load(labels_path, mmap_mode = 'r')
+
+        if labels is None:
+            dims, pixIDList = self.readSVFile(frame)
+            if len(pixIDList) > 0:
+                shape = tuple(int(dim) for dim in dims[::-1, 0])
+            else:
+                shape = self.readInputImage(frame).shape
+            labels = labelSuperVoxels(pixIDList, shape)
+
+            if self._frames_cache_path is not None:
+                try:
+                    ensure_dir(labels_path)
+                    np.save(labels_path + '.tmp.npy', labels)
+                    os.replace(labels_path + '.tmp.npy', labels_path)
+                    np.save(key_path, np.asarray(fileKey(binary_path), dtype = np.int64))
+                except (IOError, OSError):
+                    print('WARNING! Cache file %s could not be written.'%labels_path)
+
+        if not nuclei:
+            return labels
+
+        # supervoxel label -> nucleus label
+        if filtered:
+            ids, svIDs = self.getSvIDsInFrame(frame, filtered = True)
+        else:
+            ids, svIDs = self.tracks.frameIDs(frame), self.pos[frame].svIDs()
+        n_sv = [sv.shape[0] for sv in svIDs]
+        sv_values = np.concatenate([np.zeros(0, np.int64)] + [np.asarray(sv, dtype = np.int64) for sv in svIDs])
+        n_labels = max(int(labels.max()), int(sv_values.max())+1 if sv_values.shape[0] else 0)
+        lut = np.zeros(n_labels+1, dtype = np.uint32)
+        lut[sv_values+1] = np.repeat(np.asarray(ids, dtype = np.uint32) + 1, n_sv)
+
+        return lut[labels]
+
     def printTrackData(self, path, filtered=True):
         """ 
         Write a text file with all the track numbers, the frame it starts
         and how long it lasts
         """
+        lengths = self.tracks.lengths().tolist()
+        t_appearance = self.t_appearance.tolist()
+        tracks = self.index_filter if filtered else range(len(self.tracks))
 
         f = open(path, 'w')
-        for i, t in enumerate(self.t_appearance):
-            if not filtered:
-                f.write('{id}\t{time}\t{length}\n'.format(id = i, time = t, length=len(self.id_seq[i])))
-            else:
-                if i in self.index_filter:
-                    f.write('{id}\t{time}\t{length}\n'.format(id = i, time = t, length=len(self.id_seq[i])))
+        for i in tracks:
+            f.write('{id}\t{time}\t{length}\n'.format(id = i, time = t_appearance[i], length=lengths[i]))
 
         f.close()
         return True
 
+    @property
+    def index_filter(self):
+        """
+        Indexes of the tracks that passed the filters
+        """
+        return np.flatnonzero(self._filter_mask).tolist()
+
+    @index_filter.setter
+    def index_filter(self, indexes):
+        self._filter_mask = np.zeros(len(self.tracks), dtype = bool)
+        self._filter_mask[self._trackIndexes(indexes)] = True
+
+    def _trackIndexes(self, indexes):
+        """
+        Track indexes as an array, without the ones that are not 
+        tracks (negative or past the last track)
+        """
+        indexes = np.asarray(list(indexes), dtype = np.int64).reshape(-1)
+        return indexes[(indexes >= 0) & (indexes < len(self.tracks))]
+
+    def _resetFilter(self):
+        """
+        Include all the tracks and forget the filter configuration
+        """
+        self._filter_mask = np.ones(len(self.tracks), dtype = bool)
+        self._filter_config = {}
+
     def minFrameFilter(self, min_frames, keep_previous = True):
         """
         For each time frame we include only the ids that
@@ -343,38 +2205,31 @@ class TrackingAnalysis(object):
         """
 
         # In case of no filter give warning and stop
-        if not self.index_filter:
+        if not self._filter_mask.any():
             print("WARNING! Cells not tracked or all cells filtered. No min_frames condition applied.")
             return None
 
         if not keep_previous:
         # reset variables if not keeping the old values
-            self.index_filter = list(range(len(self.id_seq)))
-            self._filter_config = {}
+            self._resetFilter()
         else:
         # check whether this was still done
             if self.MIN_FRAMES_KEY in self._filter_config:
                 # if less restrictive condition, do nothing
-                if self._filter_config[self.MIN_FRAMES_KEY] <= min_frames:
+                if self._filter_config[self.MIN_FRAMES_KEY] >= min_frames:
                     return self.index_filter 
                     
-        # check conditions
-        did_not_pass = []
-        for idx, id_seq in enumerate(self.id_seq):
-            if len(id_seq) < min_frames:
-                did_not_pass.append(idx)
-
         # Apply changes
-        self.index_filter = list(set(self.index_filter) - set(did_not_pass))
+        self._filter_mask &= self.filterMask(TrackFilter.length(min_frames))
 
         # save filter configuration
         self._filter_config[self.MIN_FRAMES_KEY] = min_frames
 
-
-        if not self.index_filter:
+        n_passed = int(self._filter_mask.sum())
+        if n_passed == 0:
             print("WARNING! ALL CELLS FILTERED, consider changing the parameter min_frames")
         else:
-            print("%d tracks from a total of %d met the min_frames condition"%(len(self.index_filter), len(self.id_seq)))
+            print("%d tracks from a total of %d met the min_frames condition"%(n_passed, len(self.tracks)))
 
         return self.index_filter
 
@@ -384,7 +2239,7 @@ class TrackingAnalysis(object):
         """
         
         # In case of no filter give warning and stop
-        if not self.index_filter:
+        if not self._filter_mask.any():
             print("WARNING! Cells not tracked or all cells filtered. No black list applied.")
             return None
 
@@ -392,79 +2247,279 @@ class TrackingAnalysis(object):
             # if already filtered by black_list, merge both lists
             if self.BLACK_LIST_KEY in self._filter_config:
                 print("WARNING! This was already filtered for black_list and the results will be combined.")
-                black_list = list(set(self._filter_config[self.BLACK_LIST_KEY].append(black_list)))
+                black_list = sorted(set(self._filter_config[self.BLACK_LIST_KEY]) | set(black_list))
         else:
-            # reinitialize self.index_filter
-            self.index_filter = list(range(len(self.id_seq)))
-            self._filter_config = {}
+            # reinitialize the filter
+            self._resetFilter()
 
         # Apply changes
-        self.index_filter = list(set(self.index_filter) - set(black_list))
+        black_list = list(black_list)
+        self._filter_mask[self._trackIndexes(black_list)] = False
 
         # save filter configuration
         self._filter_config[self.BLACK_LIST_KEY] = black_list
 
         return self.index_filter
 
-    def getIDsInTime(self, filtered = True):
+    def filterMask(self, expression):
+        """
+        Boolean mask over the tracks of the condition expression (see
+        TrackFilter). The masks are kept for each signature, so that 
+        evaluating the same condition again is immediate
+        """
+        key = expression.signature
+        if key not in self._mask_cache:
+            mask = np.asarray(expression.evaluate(self), dtype = bool)
+            # the same array is returned every time
+            mask.setflags(write = False)
+            self._mask_cache[key] = mask
+
+        return self._mask_cache[key]
+
+    def applyFilter(self, expression, keep_previous = True):
         """
-        Get a list, in time, of lists of the IDs (in the XML) of the cells
-        that met the filter conditions imposed by the filters
+        Keep only the tracks that meet the condition expression 
+        (see TrackFilter)
+        ---
+        PARAMETERS
+
+        expression: TrackFilter with the condition
+        keep_previous: If previously applied filters will remain
+
+        OUTPUT
+
+        index_filter
         """
+        if not keep_previous:
+            # reinitialize the filter
+            self._resetFilter()
+        elif not self._filter_mask.any():
+            print("WARNING! Cells not tracked or all cells filtered. No filter applied.")
+            return None
+
+        # Apply changes
+        self._filter_mask = self._filter_mask & self.filterMask(expression)
 
-        n_time = len(self.pos)
-        output = [[],]*n_time
-        for t in range(n_time):
-            if (not filtered) or (not self._filter_config):
-                # get all ids in time
-                output[t] = self.pos[t][4]
+        # save filter configuration
+        self._filter_config.setdefault(self.EXPRESSION_KEY, []).append(expression.signature)
+
+        n_passed = int(self._filter_mask.sum())
+        if n_passed == 0:
+            print("WARNING! ALL CELLS FILTERED, consider changing the filter")
+        else:
+            print("%d tracks from a total of %d met the filter conditions"%(n_passed, len(self.tracks)))
+
+        return self.index_filter
+
+    def _trackPoints(self):
+        """
+        Positions (3, n_points) of the points of all the tracks, in
+        the order of the TrackStore (see TrackStore.offsets), and the 
+        track of each point
+        """
+        if self._points_cache is None:
+            if self._scratch_dir is not None:
+                self._points_cache = self._spillTrackPoints(join(self._scratch_dir, 'points'))
             else:
-                for idx, id_seq in enumerate(self.id_seq):
-                    # check if the track passed the filter
-                    if idx in self.index_filter:
-                        # now check if there is a track for this time
-                        id_ = self.Track2ID(idx, t)
-                        if id_:
-                            output[t].append(id_)
+                xyz, frame_offsets = self._framePositions()
+                xyz = xyz[:, frame_offsets[self.tracks.frame] + self.tracks.row]
+                track = np.repeat(np.arange(len(self.tracks)), self.tracks.lengths())
+                self._points_cache = (xyz, track)
+
+        return self._points_cache
+
+    def _spillTrackPoints(self, folder):
+        """
+        Same as _trackPoints, but the points are written frame by frame
+        in memory-mapped files in folder, so that the points of all the
+        tracks are never in memory at the same time
+        """
+        offsets = self.tracks.offsets
+        t_appearance = self.tracks.t_appearance
+        occupancy = self.tracks.occupancy()
+        n_points = int(offsets[-1])
+
+        points = _emptyArrays(folder, {'xyz': ((3, n_points), np.float64), 
+            'track': ((n_points,), np.int64)})
+        for t in range(len(occupancy['offsets'])-1):
+            ini, end = occupancy['offsets'][t:t+2]
+            tracks = np.asarray(occupancy['tracks'][ini:end], dtype = np.int64)
+            # position of the point of each track in the order of the store
+            index = offsets[tracks] + t - t_appearance[tracks]
+            points['xyz'][:, index] = self.pos[t].xyz[:, occupancy['row'][ini:end]]
+            points['track'][index] = tracks
+        points = _closeArrays(folder, points)
+
+        return points['xyz'], points['track']
+
+    def trackFeatures(self, pixel_size = 1.0, frame_interval = 1.0):
+        """
+        Table of properties of all the tracks, computed in one pass over
+        the points of the tracks. The distances are in the units of
+        pixel_size, with the z axis scaled by the anisotropy, and the
+        speeds in these units per frame_interval. The table is kept
+        until the tracks change (trackCells or appendFrames)
+        ---
+        PARAMETERS
+
+        pixel_size: XY size of the pixel (1 is pixels)
+        frame_interval: time between frames (1 is frames)
 
-        return output
+        OUTPUT
+
+        dictionary of arrays with a value per track:
+            length -> number of frames
+            start_frame, end_frame -> first and last frames
+            net_displacement -> distance between the first and last points
+            path_length -> sum of the distances between frames
+            mean_speed, max_speed -> speed between frames (0 if length is 1)
+            parent_track -> track that divided into the track (-1 if none)
+            from_division -> if the track was created by a division
+            divides -> if the track divided
+        """
+        key = (float(pixel_size), float(frame_interval))
+        if key not in self._features_cache:
+            n_tracks = len(self.tracks)
+            offsets = self.tracks.offsets
+            length = self.tracks.lengths()
+            start_frame = self.tracks.t_appearance
+            parent_track = self._parentTracks()
+
+            path_length = np.zeros(n_tracks)
+            max_step = np.zeros(n_tracks)
+            net_displacement = np.zeros(n_tracks)
+
+            # the points (maybe memory-mapped) are read by chunks of whole tracks
+            xyz, track = self._trackPoints()
+            ini_track = 0
+            while ini_track < n_tracks:
+                end_track = np.searchsorted(offsets, offsets[ini_track] + self.FEATURES_CHUNK, side = 'right') - 1
+                end_track = min(max(end_track, ini_track + 1), n_tracks)
+                ini, end = offsets[ini_track], offsets[end_track]
+                starts = offsets[ini_track:end_track] - ini
+                chunk = np.asarray(xyz[:, ini:end])
+
+                # step from the previous point of the same track to each point
+                step = np.zeros(end - ini)
+                step[1:] = np.sqrt((self._scaleXYZ(np.diff(chunk, axis = 1).T)**2).sum(axis = 1))
+                step[starts] = 0
+                step *= pixel_size
+
+                path_length[ini_track:end_track] = np.add.reduceat(step, starts)
+                max_step[ini_track:end_track] = np.maximum.reduceat(step, starts)
+                first = chunk[:, starts].T
+                last = chunk[:, np.append(starts[1:], end - ini) - 1].T
+                net_displacement[ini_track:end_track] = pixel_size*np.sqrt(
+                    (self._scaleXYZ(last - first)**2).sum(axis = 1))
+                ini_track = end_track
+
+            self._features_cache[key] = {'length': length, 'start_frame': start_frame, 
+                'end_frame': start_frame + length - 1, 'net_displacement': net_displacement, 
+                'path_length': path_length, 
+                'mean_speed': path_length / np.maximum(length - 1, 1) / frame_interval,
+                'max_speed': max_step / frame_interval,
+                'parent_track': parent_track, 'from_division': parent_track >= 0,
+                'divides': np.bincount(parent_track[parent_track >= 0], minlength = n_tracks) > 0}
+
+        return self._features_cache[key]
+
+    def lineageIndex(self):
+        """
+        LineageIndex of the tracks, built the first time it is needed
+        """
+        if self._lineage_cache is None:
+            self._lineage_cache = LineageIndex(self._parentTracks())
+
+        return self._lineage_cache
+
+    def _parentTracks(self):
+        """
+        Track that divided into each track (-1 if none)
+        """
+        n_tracks = len(self.tracks)
+        parent_track = np.full(n_tracks, -1, dtype = np.int64)
+        if not self.division:
+            return parent_track
+
+        division = self._divisionArray()
+
+        # the points of the tracks are found by ID, a frame at a time
+        def tracksOfIDs(frame, ids):
+            frame_ids = np.asarray(self.tracks.frameIDs(frame))
+            order = np.argsort(frame_ids)
+            return self.tracks.frameTracks(frame)[order[np.searchsorted(frame_ids[order], ids)]]
+
+        division = division[np.argsort(division[:,0], kind = 'mergesort')]
+        frames, ini = np.unique(division[:,0], return_index = True)
+        for t, frame_division in zip(frames, np.split(division, ini[1:])):
+            parents = tracksOfIDs(t-1, frame_division[:,1])
+            for child in [2, 3]:
+                children = tracksOfIDs(t, frame_division[:,child])
+                parent_track[children] = parents
+
+        return parent_track
+
+    def _occupancyInFrame(self, frame, filtered = True):
+        """
+        Slice of the occupancy matrix (see TrackStore.occupancy) of
+        the frame, with only the tracks that meet the filter conditions
+        """
+        occupancy = self.tracks.occupancy()
+        ini, end = occupancy['offsets'][frame:frame+2]
+        out = {name: occupancy[name][ini:end] for name in ['tracks', 'ID', 'row']}
+        if filtered and self._filter_config:
+            keep = self._filter_mask[out['tracks']]
+            out = {name: values[keep] for name, values in out.items()}
+
+        return out
+
+    def getTracksInFrame(self, frame, filtered = True):
+        """
+        Get an array with the indexes of the tracks alive in the
+        frame that meet the filter conditions imposed by the filters
+        """
+        return self._occupancyInFrame(frame, filtered)['tracks']
+
+    def getIDsInTime(self, filtered = True):
+        """
+        Get a list, in time, of the arrays of the IDs (in the XML) of the
+        cells that met the filter conditions imposed by the filters
+        """
+        if (not filtered) or (not self._filter_config):
+            # get all ids in time
+            return [self.tracks.frameIDs(t) for t in range(self.n_frames)]
+
+        # one pass over the whole occupancy matrix
+        occupancy = self.tracks.occupancy()
+        keep = self._filter_mask[occupancy['tracks']]
+        offsets = np.zeros(keep.shape[0]+1, dtype = np.int64)
+        offsets[1:] = np.cumsum(keep)
+        offsets = offsets[occupancy['offsets']]
+        ids = occupancy['ID'][keep]
+
+        return [ids[offsets[t]:offsets[t+1]] for t in range(self.n_frames)]
 
     def getIDsInFrame(self, frame, filtered = True):
         """ 
-        Get a list of the IDs (ID in the XML) of the cells in the frame
+        Get an array of the IDs (ID in the XML) of the cells in the frame
         that meet the filter conditions imposed by the filters
         """
-
         if (not filtered) or (not self._filter_config):
-             # get all ids in frame
-            output = self.pos[frame][4]
-        else:
-            output = []
-            for idx, id_seq in enumerate(self.id_seq):
-                # check if the track passed the filter
-                if idx in self.index_filter:
-                    # now check if there is a track for this time
-                    id_ = self.Track2ID(idx, frame)
-                    if id_:
-                        output.append(id_)
+            # get all ids in frame
+            return self.tracks.frameIDs(frame)
 
-        return output
+        return self._occupancyInFrame(frame, filtered)['ID']
 
     def getSvIDsInFrame(self, frame, filtered = True):
         """ 
         Get a list of the supervoxel IDs of the cells in the frame
         that meet the filter conditions imposed by the filters
         """
-        ids = self.getIDsInFrame(frame, filtered)
         if (not filtered) or (not self._filter_config):
-            svIDs = self.pos[frame][3]
-        else:
-            svIDs = [[],]*len(ids)
-            for i, id_num in enumerate(ids):
-                idx = self.pos[frame][4].index(id_num)
-                svIDs[i] = self.pos[frame][3][idx]
+            return self.tracks.frameIDs(frame), self.pos[frame].svIDs()
 
-        return ids, svIDs
+        occupancy = self._occupancyInFrame(frame, filtered)
+        return occupancy['ID'], self.pos[frame].svIDs(occupancy['row'])
 
     def getAllPositions(self, frame, filtered = True):
         """
@@ -486,7 +2541,7 @@ class TrackingAnalysis(object):
         """
 
         # get all positions in a numpy array
-        pos_arr = np.asarray(self.pos[frame][0:3])
+        pos_arr = self.pos[frame].xyz
 
         if (not filtered) or (not self._filter_config):   
             # get all the points
@@ -495,66 +2550,99 @@ class TrackingAnalysis(object):
             z = pos_arr[2,:]
         else:
 
-            # get all the ids in a numpy array
-            ids = np.asarray(self.pos[frame][4])
-
-            # now get only the IDs we want (mask of boolean in numpy)
-            ok_ids = np.asarray(self.getIDsInFrame(frame))
-            to_include = np.in1d(ids, ok_ids)
+            # now get only the rows we want, in the frame order
+            rows = np.sort(self._occupancyInFrame(frame, filtered)['row'])
 
             # finally only the positions we want
-            x = pos_arr[0,to_include]
-            y = pos_arr[1,to_include]
-            z = pos_arr[2,to_include]
+            x = pos_arr[0,rows]
+            y = pos_arr[1,rows]
+            z = pos_arr[2,rows]
 
         return x,y,z
 
+    def _filterKey(self, filtered = True):
+        """
+        Hashable signature of the filter in use, to cache the
+        results that depend on it. None if nothing is filtered
+        """
+        if (not filtered) or (not self._filter_config):
+            return None
+
+        return (repr(sorted(self._filter_config.items())), 
+            hash(self._filter_mask.tobytes()))
+
+    def _framePositions(self):
+        """
+        Positions of all the points of all the frames in one array
+        (3, n_points). The points of frame t are in the columns
+        frame_offsets[t]:frame_offsets[t+1]
+        """
+        packed = getattr(self.pos, '_packed', None)
+        if packed is not None and len(packed['frame_offsets']) == self.n_frames+1:
+            return np.asarray(packed['xyz']), np.asarray(packed['frame_offsets'])
+
+        # a single pass over the frames
+        xyz = [self.pos[t].xyz for t in range(self.n_frames)]
+        frame_offsets = np.concatenate(([0], np.cumsum([pos.shape[1] for pos in xyz]))).astype(np.int64)
+        xyz = np.concatenate([np.zeros((3,0))] + xyz, axis = 1)
+
+        return xyz, frame_offsets
+
     def getCenterOfMass(self, filtered = True):
         """ 
         Get the center of mass coordinates of the points
         in time. The output is [x, y, z] with x,y,z the
-        size of the time
+        size of the time (None in the frames without points).
+        The result is kept for the current filter configuration
         """
-        n_time = len(self.pos)
-        x_mean = [0.0,]*n_time
-        y_mean = [0.0,]*n_time
-        z_mean = [0.0,]*n_time      
-        for frame in range(n_time):
-            # get all the positions of the filtered points
-            x,y,z = self.getAllPositions(frame, filtered)
-            x_mean[frame] = np.asarray(x).mean() if len(x) > 0 else None
-            y_mean[frame] = np.asarray(y).mean() if len(y) > 0 else None
-            z_mean[frame] = np.asarray(z).mean() if len(z) > 0 else None
-
-        return x_mean, y_mean, z_mean
+        key = (self.n_frames, self._filterKey(filtered))
+        if key not in self._com_cache:
+            xyz, frame_offsets = self._framePositions()
+            if key[1] is None:
+                # all the points of each frame
+                frame = np.repeat(np.arange(self.n_frames), np.diff(frame_offsets))
+            else:
+                # only the points of the tracks that passed the filters
+                occupancy = self.tracks.occupancy()
+                keep = self._filter_mask[occupancy['tracks']]
+                frame = np.repeat(np.arange(self.n_frames), 
+                    np.diff(occupancy['offsets']))[keep]
+                xyz = xyz[:, frame_offsets[frame] + occupancy['row'][keep]]
+
+            # weighted sums of the coordinates per frame
+            counts = np.bincount(frame, minlength = self.n_frames)
+            com = np.full((3, self.n_frames), np.nan)
+            for k in range(3):
+                sums = np.bincount(frame, weights = xyz[k], minlength = self.n_frames)
+                np.divide(sums, counts, out = com[k], where = counts > 0)
+
+            self._com_cache = {key: (com, counts > 0)}
+
+        com, has_points = self._com_cache[key]
+        return tuple([value if ok else None for value, ok in zip(com[k].tolist(), has_points.tolist())] 
+            for k in range(3))
 
     def getWholeMovement(self, track_index):
         """
         Get all the positions in time of a track denominated
         by the value track_index
         """
-        if self._n_cell == 0:
+        if len(self.tracks) == 0:
         # if not yet run
             self.trackCells()
 
-        if track_index < len(self.id_seq):
-            # initialize variables
-            t_ini = self.t_appearance[track_index]
-            id_seq = self.id_seq[track_index]
-            seq_len = len(id_seq)
-            t = [0,]*seq_len
+        if track_index < len(self.tracks):
+            # the frame and row of each point come from the track store
+            ini, end = self.tracks.offsets[track_index:track_index+2]
+            t = self.tracks.frame[ini:end].tolist()
+            rows = self.tracks.row[ini:end].tolist()
+            seq_len = len(t)
             x = [0.0,]*seq_len
             y = [0.0,]*seq_len
             z = [0.0,]*seq_len
 
-            for dt, id_ in enumerate(id_seq):
-                time = t_ini+dt
-                t[dt] = time
-                all_ids = self.pos[time][4]
-                idx = all_ids.index(id_)
-                x[dt] = self.pos[time][0][idx]
-                y[dt] = self.pos[time][1][idx]
-                z[dt] = self.pos[time][2][idx]
+            for dt, (time, idx) in enumerate(zip(t, rows)):
+                x[dt], y[dt], z[dt] = self.pos[time].xyz[:,idx].tolist()
 
         else:
             print("Required track does not exist.")
@@ -562,118 +2650,271 @@ class TrackingAnalysis(object):
 
         return t, x, y, z
 
+    def getMovements(self, track_indices = None):
+        """
+        Get all the positions in time of several tracks at once,
+        gathered frame by frame from the track store
+        ---
+        PARAMETERS
+
+        track_indices: indexes of the tracks (None for the filtered tracks)
+
+        OUTPUT
+
+        xyz: array (n_tracks, n_frames, 3) with the positions, NaN
+        where the track does not exist
+        valid: boolean array (n_tracks, n_frames), True where the
+        track exists
+
+        Raises IndexError if a track does not exist
+        """
+        if track_indices is None:
+            track_indices = self.index_filter
+        track_indices = np.asarray(track_indices, dtype = np.int64).reshape(-1)
+        n_tracks = track_indices.shape[0]
+
+        xyz = np.full((n_tracks, self.n_frames, 3), np.nan)
+        valid = np.zeros((n_tracks, self.n_frames), dtype = bool)
+        if n_tracks == 0:
+            return xyz, valid
+        if track_indices.max() >= len(self.tracks) or track_indices.min() < 0:
+            raise IndexError("Required track does not exist.")
+
+        # position in the store of all the points of the tracks
+        offsets = self.tracks.offsets
+        counts = offsets[track_indices+1] - offsets[track_indices]
+        out_index = np.repeat(np.arange(n_tracks), counts)
+        first = np.cumsum(counts) - counts
+        flat = np.arange(counts.sum()) + np.repeat(offsets[track_indices] - first, counts)
+        frames = self.tracks.frame[flat]
+        rows = self.tracks.row[flat]
+        valid[out_index, frames] = True
+
+        # one gather per frame (only the frames with points are read)
+        order = np.argsort(frames, kind = 'mergesort')
+        bounds = np.zeros(self.n_frames+1, dtype = np.int64)
+        bounds[1:] = np.cumsum(np.bincount(frames, minlength = self.n_frames))
+        for frame in np.flatnonzero(np.diff(bounds)).tolist():
+            sel = order[bounds[frame]:bounds[frame+1]]
+            xyz[out_index[sel], frame, :] = self.pos[frame].xyz[:,rows[sel]].T
+
+        return xyz, valid
+
     def ID2Track(self, id_num, frame):
         """
         Return the number of the track ID
         given the ID of the particle and the time frame
         """
-        if id_num in self.dict_track[frame]:
-            return self.dict_track[frame][id_num]
+        row = self.pos[frame].row(id_num)
+        if row is None:
+            return None
 
-        return None
+        return self.tracks.row2Track(frame, row)
 
     def Track2ID(self, track, frame):
         """
         Return the ID of the particle
         given the track ID and the time frame
         """
-        t_ini = self.t_appearance[track]
-        id_seq = self.id_seq[track]
-        if (frame >= t_ini) and (frame < len(id_seq) + t_ini):
-            return id_seq[frame-t_ini]
+        return self.tracks.track2ID(track, frame)
 
-        return None
+    def _scaleXYZ(self, xyz):
+        """
+        Points (n, 3) in the XML coordinates with the z axis
+        scaled by the anisotropy, so that distances are isotropic
+        """
+        scale = np.array([1.0, 1.0, self.configs[self.ANISOTROPY_KEY]])
+        return np.asarray(xyz, dtype = np.float64) * scale
+
+    def kdTree(self, frame):
+        """
+        KD-tree (scipy cKDTree) of the nuclei in the frame, with the
+        z axis scaled by the anisotropy. The tree is built the first
+        time it is needed and kept for the next queries
+        """
+        if frame < 0:
+            frame += self.n_frames
+        if frame not in self._kdtrees:
+            self._kdtrees[frame] = cKDTree(self._scaleXYZ(self.pos[frame].xyz.T))
 
-    def _addTrack(self, t, id_num):
+        return self._kdtrees[frame]
+
+    def nearest(self, frame, xyz, k = 1):
         """
-        Add new track to data
+        Get the k nuclei closest to the points xyz in the frame
+        ---
+        PARAMETERS
+
+        frame: time frame of the nuclei
+        xyz: point [x, y, z], or array of points (n, 3), in the 
+        XML coordinates
+        k: number of neighbours
+
+        OUTPUT
+
+        dist, ids: distances (z scaled by the anisotropy) and IDs 
+        (in the XML) of the nuclei, with the shapes of cKDTree.query.
+        If the frame has less than k nuclei, the missing neighbours 
+        have distance inf and ID -1
         """
-        # Add a new sequence
-        self.id_seq.append([])
-        self.id_seq[self._n_cell].append(id_num)
+        tree = self.kdTree(frame)
+        dist, rows = tree.query(self._scaleXYZ(xyz), k = k)
 
-        # Include the time it was added
-        self.t_appearance.append(t)
+        # the row n is returned for the missing neighbours
+        ids = np.append(self.pos[frame].ID, -1)[rows]
 
-        # Insert it in control variables
-        self.dict_track[t][id_num] = self._n_cell
-        self._n_cell += 1
+        return dist, ids
 
-    def _addDivision(self, t, child2_id, parent_index):
+    def within(self, frame, xyz, r):
         """
-        Add new division
+        Get the nuclei at a distance of at most r from the points 
+        xyz in the frame. The distances are computed with the z axis
+        scaled by the anisotropy
+        ---
+        PARAMETERS
+
+        frame: time frame of the nuclei
+        xyz: point [x, y, z], or array of points (n, 3), in the 
+        XML coordinates
+        r: radius
+
+        OUTPUT
+
+        Array of IDs (in the XML) of the nuclei around the point, or
+        a list of these arrays if there are several points
         """
-        # First get the data to save
-        parent_id = self.id_seq[parent_index][-2]
-        child1_id = self.id_seq[parent_index][-1]
+        tree = self.kdTree(frame)
+        points = self._scaleXYZ(xyz)
+        ids = self.pos[frame].ID
+        if points.ndim == 1:
+            return ids[np.sort(np.asarray(tree.query_ball_point(points, r), dtype = np.int64))]
+
+        return [ids[np.sort(np.asarray(rows, dtype = np.int64))] 
+            for rows in tree.query_ball_point(points, r)]
 
-        # Remove previously added id in parent sequence
-        self.id_seq[parent_index] = self.id_seq[parent_index][:-1]
+    @property
+    def id_seq(self):
+        """
+        Sequence of IDs of each track (see TrackStore)
+        """
+        return self.tracks
 
-        # Remove parent from control lists
-        del self.dict_track[t][child1_id]
+    @property
+    def t_appearance(self):
+        """
+        Frame where each track starts
+        """
+        return self.tracks.t_appearance
 
-        # Add childs to new indexes
-        self._addTrack(t, child1_id)
-        self._addTrack(t, child2_id)
+    def _setTracks(self, tracks, division):
+        """
+        Set the track variables from the TrackStore and the 
+        divisions (see trackFrames)
+        """
+        self.tracks = tracks
+        self.division = [{'t': t, 'parent_id': parent_id, 'child1_id': child1_id, 'child2_id': child2_id}
+            for t, parent_id, child1_id, child2_id in division.tolist()]
 
-        # Add data to division variable
-        self.division.append({'t': t, 'parent_id': parent_id, 
-            'child1_id': child1_id, 'child2_id': child2_id})
+        # all track indexes are included, no filter (yet)
+        self._resetFilter()
+        self._clearTrackCaches()
 
+    def _clearTrackCaches(self):
+        """
+        Forget the per-track values and filter masks, after
+        the tracks change
+        """
+        self._mask_cache = {}
+        self._points_cache = None
+        self._features_cache = {}
+        self._lineage_cache = None
 
     def trackCells(self):
         """
         The nuclei are indexed as they appear, and by
         verifying the parenting we check if the cell continues
-        to exist in each frame.
-
-        The variable id_seq carries the id sequence followed by
-        this cell. The variable t_appearance states the frame the
-        nucleus appeared.
+        to exist in each frame (see linkFrame).
 
-        For easieness, we store the last ID of each tracked cell
-        in the variables last_id and last_id_index
+        The tracks are kept in a TrackStore. The variable id_seq
+        carries the id sequence followed by this cell. The variable 
+        t_appearance states the frame the nucleus appeared.
         """        
-        # variable initialization
-        self.t_appearance = []
-        self.id_seq = []
-        self._n_cell = 0
-        self.division = []
-        self.dict_track = {}
-
         t_ini = self.configs[self.TIME_INI_KEY]
+        # in the scratch folder, each frame goes to disk once linked
+        tracks = TrackStore(None if self._scratch_dir is None else join(self._scratch_dir, 'tracks'))
+        divisions = [np.zeros((0, 4), dtype = np.int64)]
+        losts = [np.zeros((0, 2), dtype = np.int64)]
+        for ids, frame_tracks, n_tracks, division, lost in linkFrames(self.pos, t_ini):
+            tracks.appendFrame(ids, frame_tracks, n_tracks)
+            divisions.append(division)
+            losts.append(lost)
+        self._lost = np.concatenate(losts)
+        self._setTracks(tracks, np.concatenate(divisions))
+
+        return self.id_seq, self.t_appearance
+
+    def appendFrames(self, max_frames = None):
+        """
+        Read the frames written by the tracking software after the last
+        frame loaded (e.g. while it is still running) and extend the
+        tracks from the last known state, without reading or tracking
+        the previous frames again. A frame whose XML is not complete yet
+        is left for the next call. 
+        
+        The new tracks only enter index_filter if no filter is applied,
+        otherwise the filters need to be applied again. The cache is
+        not updated.
+        ---
+        PARAMETERS
 
-        # Initialize points with first frame
-        self.dict_track[0] = {}
-        for id_num in self.pos[0][4]:
-            self._addTrack(0, id_num)
-
-        # From frame=1 on...
-        for t, data_t in enumerate(self.pos[1:]):
-            self.dict_track[t+1] = {}
-            # check all the cells in this frame
-            for cell, id_num in enumerate(data_t[4]):
-                parent = data_t[5][cell]
-                if parent == -1:
-                    # new track
-                    self._addTrack(t+1, id_num)
-                elif parent in self.dict_track[t]:
-                    # check if parent is in the previous list
-                    index = self.dict_track[t][parent]
-                    if index in self.dict_track[t+1].values():
-                        # then we have cell division, and we monitor the child separarely
-                        self._addDivision(t+1, id_num, index)
-                    else:
-                        # cell continues in the same track
-                        self.id_seq[index].append(id_num)
-                        self.dict_track[t+1][id_num] = index
-                else:
-                    # weird things happened!
-                    print("Warning! Time %s, Cell ID %s lost track"%(str(t+t_ini), str(id_num)))
+        max_frames: maximum number of frames to add (None is all)
 
+        OUTPUT
 
-        # all track indexes are included, no filter (yet)
-        self.index_filter = list(range(len(self.id_seq)))
+        number of frames added
+        """
+        xml_path = self.configs[self.XML_PATH_KEY]
+        t_ini = self.configs[self.TIME_INI_KEY]
 
-        return self.id_seq, self.t_appearance
\ No newline at end of file
+        n_added = 0
+        while max_frames is None or n_added < max_frames:
+            t = self.n_frames
+            path = corrTIFPath(xml_path, '?', t_ini + t)
+            if not os.path.isfile(path):
+                break
+            try:
+                frame, corrupted = _parseXMLAmatFrame(path)
+            except etree.XMLSyntaxError:
+                # file still being written
+                break
+            _printCorruptedPoints(path, corrupted)
+
+            # link to the tracks of the last frame
+            n_old = len(self.tracks)
+            if t == 0:
+                # every point of the first frame starts a track (see trackFrames)
+                tracks, n_tracks = np.arange(frame.n_points, dtype = np.int64), frame.n_points
+                division, lost = np.zeros((0, 3), dtype = np.int64), np.zeros(0, dtype = np.int64)
+            else:
+                tracks, n_tracks, division, lost = linkFrame(self.pos[t-1], 
+                    self.tracks.frameTracks(t-1), frame, n_old)
+            lost = np.stack((np.full(lost.shape[0], t), frame.ID[lost]), axis = 1).astype(np.int64)
+            _printLostTracks(lost, t_ini)
+            self._lost = np.concatenate((self._lost, lost))
+
+            if isinstance(self.pos, LazyFrames):
+                self.pos.append(path, frame)
+            else:
+                self.pos.append(frame)
+            self.tracks.appendFrame(frame.ID, tracks, n_tracks)
+            self.division.extend({'t': t, 'parent_id': parent_id, 'child1_id': child1_id, 'child2_id': child2_id}
+                for parent_id, child1_id, child2_id in division.tolist())
+            self._filter_mask = np.concatenate((self._filter_mask, 
+                np.full(n_tracks - n_old, not self._filter_config)))
+
+            self.n_frames += 1
+            self._clearTrackCaches()
+            self.configs[self.TIME_END_KEY] = t_ini + t
+            n_added += 1
+
+        return n_added
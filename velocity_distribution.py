@@ -48,9 +48,15 @@ def main(*args):
         vy = np.zeros((N, n_frames-1))
         vz = np.zeros((N, n_frames-1))
 
+        # all the tracks at once, (track, time, 3)
+        movements, valid = track.getMovements(track_ids)
+
         for cell,track_id in enumerate(track_ids):
 
-            data = np.array(track.getWholeMovement(track_id))
+            # data is an array (4, time), where 4 is:
+            # 0 -> frame, 1-3 -> x,y,z
+            frames = np.flatnonzero(valid[cell])
+            data = np.vstack((frames, movements[cell, frames, :].T))
 
             if date == '2015_8_27_10_28_52':
                 test = np.logical_and(
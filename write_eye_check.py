@@ -51,6 +51,10 @@ def writeEyeCheck(frame_ini, frame_end, track):
         pixPoints = calcPixelsAddress(svIDList, pixIDList, dims[0,0], dims[1,0])
         pixPointsSV = calcAllPixelsAddress(pixIDList, dims[0,0], dims[1,0])
 
+        # pixels sorted by stack, to get each stack without going through all
+        pixSlices = PixelSlices(pixPoints, im_out.shape[0])
+        pixSlicesSV = PixelSlices(pixPointsSV, im_out.shape[0])
+
         n_stacks = im_out.shape[0]
         ax = plt.subplot(1,1,1)
         for stack in range(n_stacks):
@@ -77,7 +81,7 @@ def writeEyeCheck(frame_ini, frame_end, track):
             pix_x, pix_y = np.meshgrid(np.arange(0,size[1],1), np.arange(0,size[0],1))
 
             # get all coordinates of pixels in this stack
-            sv_pix = pixPoints[np.equal(pixPoints[:,2],stack),:]
+            sv_pix = pixSlices[stack]
             sv_pix = sv_pix.astype(int)
             sv_image = np.zeros((size[0], size[1]))
             sv_image[sv_pix[:,1], sv_pix[:,0]] = 1
@@ -101,7 +105,7 @@ def writeEyeCheck(frame_ini, frame_end, track):
             image_out_corr = correct_path(image_out_path_SV, time_to_analyze+t_ini, stack+1)
 
             # get all coordinates of pixels in this stack
-            sv_pix = pixPointsSV[np.equal(pixPointsSV[:,2],stack),:]
+            sv_pix = pixSlicesSV[stack]
             sv_pix = sv_pix.astype(int)
             sv_image = np.zeros((size[0], size[1]))
             sv_image[sv_pix[:,1], sv_pix[:,0]] = 1